@@ -13,12 +13,20 @@ class Camera:
         fps: int = 24,
         fpo: int = 8,
         device: str = "/dev/video0",
+        num_clips: int = 2,
     ):
         self.width = width
         self.height = height
         self.fps = fps
         self.fpo = fpo
         self.device = device
+        self.frame_size = width * height * 3
+        # Frames are read straight into these buffers, nothing is allocated per frame.
+        # image() returns the same buffer every call and video() rotates through
+        # num_clips clips, so a returned clip stays valid for num_clips - 1 more calls.
+        self.frame = np.empty((height, width, 3), np.uint8)
+        self.clips = np.empty((num_clips, fpo, height, width, 3), np.uint8)
+        self.clip_index = 0
         self.cap = self.start_capture()
 
     def start_capture(self):
@@ -30,26 +38,26 @@ class Camera:
                 framerate=self.fps,
             ).output("pipe:", format="rawvideo", pix_fmt="rgb24").run_async(pipe_stdout=True)
 
+    def _read_into(self, out: np.ndarray) -> None:
+        view = memoryview(out).cast("B")
+        filled = 0
+        while filled < self.frame_size:
+            n = self.cap.stdout.readinto(view[filled:])
+            if not n:
+                log.error("Failed to capture frame")
+                raise RuntimeError("Failed to capture frame")
+            filled += n
+
     def image(self) -> np.ndarray:
-        raw_image = self.cap.stdout.read(self.width * self.height * 3)
-        if not raw_image:
-            log.error("Failed to capture frame")
-            raise RuntimeError("Failed to capture frame")
-        image = np.frombuffer(raw_image, np.uint8).reshape([self.height, self.width, 3])
-        log.debug(f"Captured image {image.shape}")
-        return image
+        self._read_into(self.frame)
+        log.debug(f"Captured image {self.frame.shape}")
+        return self.frame
 
     def video(self) -> np.ndarray:
-        observation = np.zeros((self.fpo, self.height, self.width, 3), np.uint8)
+        observation = self.clips[self.clip_index]
+        self.clip_index = (self.clip_index + 1) % len(self.clips)
         for i in range(self.fpo):
-            raw_image = self.cap.stdout.read(self.width * self.height * 3)
-            if not raw_image:
-                log.error("Failed to capture frame")
-                raise RuntimeError("Failed to capture frame")
-            image = np.frombuffer(raw_image, np.uint8).reshape(
-                [self.height, self.width, 3]
-            )
-            observation[i] = image
+            self._read_into(observation[i])
         log.debug(f"Captured {observation.shape}")
         return observation
 
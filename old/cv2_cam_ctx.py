@@ -5,6 +5,8 @@ Check your camera is working with:
 v4l2-ctl --list-devices
 ffplay -f v4l2 -framerate 30 -video_size 224x224 -i /dev/video0
 
+Run from the repo root with python -m old.cv2_cam_ctx
+
 """
 
 import logging
@@ -14,6 +16,8 @@ from contextlib import contextmanager
 import cv2
 import numpy as np
 
+from src.frame import Frame
+
 log = logging.getLogger(__name__)
 
 @contextmanager
@@ -30,7 +34,7 @@ def camera_ctx(
     fps (int): The frames per second of the video.
 
     Yields:
-    function: A function that captures a frame and returns it as a numpy array.
+    function: A function that captures a frame and returns it as a Frame.
     """
     log.info(f"Starting video capture at {width}x{height} {fps}fps")
     cap = cv2.VideoCapture(0, cv2.CAP_V4L2)
@@ -38,23 +42,29 @@ def camera_ctx(
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
     cap.set(cv2.CAP_PROP_FPS, fps)
 
-    def np_image() -> np.ndarray:
-        """Capture a frame and return it as a numpy array.
+    frame_count = 0
+
+    def np_image() -> Frame:
+        """Capture a frame and return it as a Frame.
+
+        The pixels stay in OpenCV's BGR order, use Frame.view("RGB") for a
+        copy free RGB view.
 
         Returns:
-        np.ndarray: The captured frame.
+        Frame: The captured frame.
 
         Raises:
         RuntimeError: If a frame capture fails.
         """
+        nonlocal frame_count
+        timestamp = time.monotonic()
         ret, image = cap.read()
         if not ret:
             log.error("Failed to capture frame")
             raise RuntimeError("Failed to capture frame")
-        # convert opencv output from BGR to RGB
-        image = image[:, :, [2, 1, 0]]
+        frame_count += 1
         log.debug(f"Captured image {image.shape}")
-        return image
+        return Frame(image, "BGR", "cv2", timestamp=timestamp, seq=frame_count)
 
     try:
         yield np_image
@@ -64,7 +74,7 @@ def camera_ctx(
 
 if __name__ == "__main__":
     with camera_ctx() as snapshot:
-        image = snapshot()
-    cv2.imshow("image", image)
+        frame = snapshot()
+    cv2.imshow("image", frame.view("BGR"))
     cv2.waitKey(0)
     cv2.destroyAllWindows()
\ No newline at end of file
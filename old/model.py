@@ -1,12 +1,14 @@
-""" Start play mode. """
+""" Start play mode. Run from the repo root with python -m old.model """
 
-from imagenet_labels import classes
+from old.imagenet_labels import classes
 import logging
 import time
 from contextlib import contextmanager
 
 import torch
-from torchvision import models, transforms
+from torchvision import models
+
+from src.preprocess import ModelInput
 
 
 # from servo import servo_ctx
@@ -36,26 +38,22 @@ IMAGENET_CATS = {
 def model(*args, **kwds):
     log.info("Starting AI model")
     torch.backends.quantized.engine = 'qnnpack'
-    preprocess = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(
-            mean=[0.485, 0.456, 0.406],
-            std=[0.229, 0.224, 0.225]),
-    ])
+    # Crops, resizes and normalizes uint8 frames into one reused input tensor
+    preprocess = ModelInput()
     net = models.quantization.mobilenet_v2(pretrained=True, quantize=True)
     # jit model to take it from ~20fps to ~30fps
     net = torch.jit.script(net)
 
     def inference(x):
         with torch.no_grad():
-            # Create a mini-batch as expected by the model
-            x = preprocess(x).unsqueeze(0)
+            # Already a mini-batch of one as expected by the model
+            x = preprocess(x)
             x = net(x)[0]
             return x
     try:
         yield inference
     finally:
-        log.info("Ended AI model")
+        log.info(f"Ended AI model, preprocess timing {preprocess.timing.to_dict()}")
         pass
 
 
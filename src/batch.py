@@ -0,0 +1,19 @@
+import asyncio
+import time
+from typing import Any, List
+
+
+async def next_batch(queue: asyncio.Queue, max_size: int, window: float) -> List[Any]:
+    # Waits for one item, then takes whatever else arrives within window
+    # seconds, up to max_size items
+    batch = [await queue.get()]
+    deadline = time.monotonic() + window
+    while len(batch) < max_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
@@ -1,9 +1,12 @@
 import asyncio
 import logging
+import re
+import threading
 import time
+from collections import Counter, deque
 from datetime import timedelta
-from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Set
 
 from dynamixel_sdk import (
     PortHandler,
@@ -17,6 +20,21 @@ from dynamixel_sdk import (
     DXL_HIWORD,
 )
 
+from .batch import next_batch
+from .intent import IntentClassifier
+from .policy import RequestPolicy
+from .prompt import PROMPTS, CompiledPrompt
+from .servos import (
+    DEGREE_TO_UNIT,
+    POSES,
+    SERVOS,
+    Pose,
+    Servo,
+    degrees_to_units,
+    make_pose_classifier,
+    units_to_degrees,
+)
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 ROBOT_TOKEN: str = "🤖"
@@ -29,19 +47,6 @@ SYSTEM_PROMPT: str = f"""
 You are an llm control unit for a robot arm called {ROBOT_TOKEN}.
 """
 
-@dataclass
-class Servo:
-    id: int # dynamixel id for servo
-    name: str # name of servo for llm use
-    range: Tuple[int, int] # (min, max) position values for servos (0, 4095)
-    desc: str # description of servo for llm use
-
-SERVOS: List[Servo] = [
-    Servo(1, "roll", (1761, 2499), "rolls the neck left and right rotating the view, roll"),
-    Servo(2, "tilt", (979, 2223), "tilts the head up and down vertically, pitch"),
-    Servo(3, "pan", (988, 3007), "pans the head side to side horizontally, yaw")
-]
-
 SERVOS_MSG: str = f"""
 {ROBOT_TOKEN} has {len(SERVOS)} servos {SERVO_TOKEN} forming a kinematic chain
 @dataclass
@@ -50,22 +55,54 @@ class Servo:
     name: str # name of servo for llm use
     range: Tuple[int, int] # (min, max) position values for servos in units (0, 4095)
     desc: str # description of servo for llm use
-{SERVO_TOKEN}: List[Servo] = [{"".join([str(s) for s in SERVOS])}]
+{SERVO_TOKEN}: List[Servo] = [{", ".join([str(s) for s in SERVOS])}]
 """
 
 @dataclass
-class Pose:
-    name: str # name of pose for llm use
-    angles: List[int] # list of int angles in degrees (0, 360)
-    desc: str # description of position for llm use
-
-POSES: Dict[str, Pose] = {
-    "home" : Pose("home", [180, 211, 180], "home position or look up"),
-    "forward" : Pose("forward", [180, 140, 180], "look ahead, facing forward"),
-    "tilt_left" : Pose("tilt_left", [215, 130, 151], "looking forward, head tilted right"),
-    "tilt_right" : Pose("tilt_right", [145, 130, 209], "looking forward, head tilted left"),
-    "face_down": Pose("face_down", [180, 94, 180], "looking down, facing forward")
-}
+class _TrieNode:
+    children: Dict[str, "_TrieNode"] = field(default_factory=dict)
+    names: Set[str] = field(default_factory=set)  # pose names below this node
+    name: Optional[str] = None  # pose name ending exactly at this node
+
+class PoseTrie:
+    # Resolves a pose from the first characters of a reply, as soon as only
+    # one pose name starts with them
+
+    def __init__(self, names: List[str]):
+        self.root = _TrieNode(names=set(names))
+        for name in names:
+            node = self.root
+            for char in name:
+                node = node.children.setdefault(char, _TrieNode())
+                node.names.add(name)
+            node.name = name
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return text.lstrip().lstrip("\"'`").lower().replace(" ", "_")
+
+    def _walk(self, text: str) -> Optional[_TrieNode]:
+        node = self.root
+        for char in self.normalize(text):
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def resolve(self, partial: str) -> Optional[str]:
+        node = self._walk(partial)
+        if node is None or node is self.root or len(node.names) != 1:
+            return None
+        return next(iter(node.names))
+
+    def is_prefix(self, partial: str) -> bool:
+        return self._walk(partial) is not None
+
+    def exact(self, text: str) -> Optional[str]:
+        node = self._walk(text.strip().strip("\"'`."))
+        return node.name if node is not None else None
+
+POSE_TRIE: PoseTrie = PoseTrie(list(POSES.keys()))
 
 POSES_MSG: str = f"""
 {ROBOT_TOKEN} can be put into {len(POSES)} different poses {POSE_TOKEN}
@@ -75,26 +112,62 @@ class Pose:
     name: str # name of pose for llm use
     angles: List[int] # list of int angles in degrees (0, 360)
     desc: str # description of position for llm use
-{SERVO_TOKEN}: List[Servo] = [{"".join([str(s) for s in SERVOS])}]
+{POSE_TOKEN}: List[Pose] = [{", ".join([str(p) for p in POSES.values()])}]
 """
 
+POSE_COMMANDS: str = "\n".join([f"{pose.name}: {pose.desc}" for pose in POSES.values()])
+
 MOVE_MSG: str = f"""
 The user will describe in natural language a {MOVE_TOKEN} command.
 Format the command so that {ROBOT_TOKEN} can understand it.
 {ROBOT_TOKEN} can accept the following commands:
-{"".join([f"{pose.name}: {pose.desc}" for pose in POSES.values()])}
+{POSE_COMMANDS}
 Return the one-word string name of the best matching pose.
 """
 
-# Convert servo units into degrees for readability
-# Max for units is 4095, which is 360 degrees
-DEGREE_TO_UNIT: float = 4095 / 360.0
+def move_prompt(system_msg: str = SYSTEM_PROMPT, move_msg: str = MOVE_MSG) -> CompiledPrompt:
+    # Compiled once per distinct (system_msg, move_msg), later calls get the same prompt
+    return PROMPTS.compile("move", [system_msg, move_msg])
 
-def degrees_to_units(degree: int) -> int:
-    return int(degree * DEGREE_TO_UNIT)
+BATCH_MSG: str = f"""
+Several {MOVE_TOKEN} commands may arrive at once as a numbered list, one per line.
+Answer every command in the same order, one per line as the number, a period and the pose name.
+For example:
+1. home
+2. face_down
+"""
 
-def units_to_degrees(position: int) -> int:
-    return int(position / DEGREE_TO_UNIT)
+def batch_prompt(
+    system_msg: str = SYSTEM_PROMPT,
+    move_msg: str = MOVE_MSG,
+    batch_msg: str = BATCH_MSG,
+) -> CompiledPrompt:
+    return PROMPTS.compile("move_batch", [system_msg, move_msg, batch_msg])
+
+BATCH_LINE = re.compile(r"^\s*(\d+)\s*[.):]\s*([\w-]+)")
+
+def format_batch(raw_move_strs: List[str]) -> str:
+    # Newlines inside a command would break the numbering
+    return "\n".join(f"{i}. {' '.join(raw.split())}" for i, raw in enumerate(raw_move_strs, 1))
+
+def parse_batch(reply: str, num_commands: int) -> List[Optional[str]]:
+    # Pose name per command, None where the reply has no valid answer
+    pose_names: List[Optional[str]] = [None] * num_commands
+    for line in reply.splitlines():
+        match = BATCH_LINE.match(line)
+        if match is None:
+            continue
+        index, pose_name = int(match.group(1)) - 1, match.group(2)
+        if 0 <= index < num_commands and pose_name in POSES:
+            pose_names[index] = pose_name
+    return pose_names
+
+# Speculative moves go this fraction of the way toward the guessed pose, slowly
+SPECULATION_FRACTION: float = 0.5
+SPECULATION_STEPS: int = 10
+SPECULATION_STEP_TIME: float = 0.05 # seconds between speculative steps
+SPECULATION_HISTORY: int = 20 # recent poses used when there is no predictor
+SPECULATION_CONTROL_EVERY: int = 10 # every nth command skips speculation to time the plain path
 
 class Robot:
 
@@ -169,6 +242,34 @@ class Robot:
             log.warning(msg)
         return msg
 
+    def approach(
+        self,
+        goal_positions: List[int],
+        fraction: float = SPECULATION_FRACTION,
+        steps: int = SPECULATION_STEPS,
+        step_time: float = SPECULATION_STEP_TIME,
+        cancel: Optional[threading.Event] = None,
+    ) -> str:
+        # Slow partial move toward goal_positions, stops at the next step once cancel is set
+        msg: str = ""
+        try:
+            start_positions = self._read_pos()
+            for i in range(1, steps + 1):
+                if cancel is not None and cancel.is_set():
+                    msg += f"{MOVE_TOKEN} approach cancelled after {i - 1} of {steps} steps\n"
+                    return msg
+                t = fraction * i / steps
+                self._write_position([
+                    round(start + t * (goal - start))
+                    for start, goal in zip(start_positions, goal_positions)
+                ])
+                time.sleep(step_time)
+            msg += f"{MOVE_TOKEN} approached {fraction:.0%} of the way to {goal_positions}\n"
+        except Exception as e:
+            msg += f"{MOVE_TOKEN} approach failed with exception {e}"
+            log.warning(msg)
+        return msg
+
     def _write_position(self, positions: List[int]) -> str:
         msg: str = ""
         # Enable torque for all servos and add goal position to the bulk write parameter storage
@@ -251,21 +352,45 @@ class Robot:
         self._disable_torque()
         self.port_handler.closePort()
 
+def make_move_policy(
+    llm_func: callable,
+    classifier: IntentClassifier,
+    **kwargs,
+) -> RequestPolicy:
+    # Hedged llm calls that fall back to the classifier's best pose at the
+    # deadline, usable anywhere an llm_func is. Hedges only send a second
+    # request without the cache, e.g. functools.partial(gpt_text_async, cache=None).
+    def fallback(messages: List[Dict[str, str]], **_) -> str:
+        return classifier.scores(messages[-1]["content"])[0][0]
+    return RequestPolicy(llm_func, fallback=fallback, **kwargs)
+
 async def move_with_prompt(
     robot: Robot,
     llm_func: callable,
     raw_move_str: int,
     system_msg: str = SYSTEM_PROMPT,
     move_msg: str = MOVE_MSG,
+    classifier: Optional[IntentClassifier] = None,
 ) -> str:
     msg: str = ""
-    desired_pose_name = llm_func(
-            max_tokens=8,
-            messages=[
-                {"role": "system", "content": f"{system_msg}\n{move_msg}"},
-                {"role": "user", "content": raw_move_str},
-            ]
-    )
+    desired_pose_name = None
+    if classifier is not None:
+        # Confident local answers skip the llm round trip entirely
+        desired_pose_name, margin = classifier.predict(raw_move_str)
+        if desired_pose_name is not None:
+            msg += f"{MOVE_TOKEN} classified locally with margin {margin:.2f}\n"
+    if desired_pose_name is None:
+        prompt = move_prompt(system_msg, move_msg)
+        log.debug(f"Prompt budget {prompt.budget(raw_move_str)}")
+        desired_pose_name = llm_func(
+                max_tokens=8,
+                messages=prompt.messages(raw_move_str),
+        )
+        if asyncio.iscoroutine(desired_pose_name):
+            # Async llm functions (gpt_text_async) leave the event loop free
+            desired_pose_name = await desired_pose_name
+        if classifier is not None and desired_pose_name in POSES:
+            classifier.add_example(raw_move_str, desired_pose_name)
     msg += f"{MOVE_TOKEN} commanded pose is {desired_pose_name}\n"
     desired_pose = POSES.get(desired_pose_name, None)
     if desired_pose is not None:
@@ -274,6 +399,249 @@ async def move_with_prompt(
         msg += f"ERROR: {desired_pose_name} is not a valid pose.\n"
         return msg
 
+async def move_with_prompt_streaming(
+    robot: Robot,
+    stream_func: Callable[..., AsyncIterator[str]],
+    raw_move_str: str,
+    system_msg: str = SYSTEM_PROMPT,
+    move_msg: str = MOVE_MSG,
+    trie: PoseTrie = POSE_TRIE,
+) -> str:
+    # Starts the move on the first tokens that pick out a single pose and
+    # cancels the rest of the stream
+    msg: str = ""
+    start_time = time.time()
+    reply: str = ""
+    desired_pose_name: Optional[str] = None
+    stream = stream_func(
+        max_tokens=8,
+        messages=move_prompt(system_msg, move_msg).messages(raw_move_str),
+    )
+    try:
+        async for delta in stream:
+            reply += delta
+            desired_pose_name = trie.resolve(reply)
+            if desired_pose_name is not None or not trie.is_prefix(reply):
+                break
+    finally:
+        await stream.aclose()
+    if desired_pose_name is None:
+        desired_pose_name = trie.exact(reply)
+    msg += f"{MOVE_TOKEN} commanded pose is {desired_pose_name} from {reply!r} after {time.time() - start_time} seconds\n"
+    desired_pose = POSES.get(desired_pose_name, None)
+    if desired_pose is None:
+        msg += f"ERROR: {reply} is not a valid pose.\n"
+        return msg
+    # The servo loop blocks, keep it off the event loop
+    msg += await asyncio.to_thread(robot.move, desired_pose.angles)
+    return msg
+
+@dataclass
+class SpeculationStats:
+    commands: int = 0 # moves commanded
+    attempts: int = 0 # speculative moves started
+    hits: int = 0 # speculation matched the llm answer
+    speculative_time: float = 0.0 # seconds from command to arrival, summed over speculative moves
+    controls: int = 0 # moves run without speculation
+    control_time: float = 0.0 # seconds from command to arrival, summed over moves without speculation
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.attempts if self.attempts else 0.0
+
+    @property
+    def saved(self) -> float:
+        # Mean seconds from command to arrival saved per speculative move,
+        # measured against the moves that ran without speculation
+        if not self.attempts or not self.controls:
+            return 0.0
+        return self.control_time / self.controls - self.speculative_time / self.attempts
+
+class Speculator:
+    # Guesses the target pose before the llm answers, from a local predictor
+    # if there is one, otherwise from the most common recent pose
+
+    def __init__(
+        self,
+        predictor: Optional[IntentClassifier] = None,
+        history: int = SPECULATION_HISTORY,
+        control_every: int = SPECULATION_CONTROL_EVERY,
+    ):
+        self.predictor = predictor
+        self.history: Deque[str] = deque(maxlen=history)
+        self.control_every = control_every # 0 never skips speculation
+        self.stats = SpeculationStats()
+
+    def guess(self, raw_move_str: str) -> Optional[str]:
+        if self.predictor is not None:
+            return self.predictor.scores(raw_move_str)[0][0]
+        if self.history:
+            return Counter(self.history).most_common(1)[0][0]
+        return None
+
+async def _ask_llm(llm_func: callable, **kwargs) -> str:
+    # Blocking llm functions run in a thread so the loop stays free, the
+    # reply is awaited if the call turns out to be async, e.g. a RequestPolicy
+    if asyncio.iscoroutinefunction(llm_func):
+        return await llm_func(**kwargs)
+    reply = await asyncio.to_thread(llm_func, **kwargs)
+    if asyncio.iscoroutine(reply):
+        reply = await reply
+    return reply
+
+async def move_with_speculation(
+    robot: Robot,
+    llm_func: callable,
+    raw_move_str: str,
+    speculator: Speculator,
+    system_msg: str = SYSTEM_PROMPT,
+    move_msg: str = MOVE_MSG,
+) -> str:
+    # Starts a slow partial move toward the guessed pose while the llm is
+    # thinking, then cancels it and sends the full move once the answer is in
+    msg: str = ""
+    control = speculator.control_every > 0 and speculator.stats.commands % speculator.control_every == 0
+    speculator.stats.commands += 1
+    guess = None if control else speculator.guess(raw_move_str)
+    messages = move_prompt(system_msg, move_msg).messages(raw_move_str)
+    answer_task = asyncio.ensure_future(_ask_llm(llm_func, max_tokens=8, messages=messages))
+    cancel = threading.Event()
+    approach_task = None
+    start_time = time.time()
+    if guess in POSES:
+        speculator.stats.attempts += 1
+        approach_task = asyncio.ensure_future(
+            asyncio.to_thread(robot.approach, POSES[guess].angles, cancel=cancel)
+        )
+    try:
+        desired_pose_name = await answer_task
+    finally:
+        # Hit or miss, the approach stops at its next step and the full move
+        # goes out, both write to the same bus so they never overlap
+        cancel.set()
+        if approach_task is not None:
+            msg += await approach_task
+    msg += f"{MOVE_TOKEN} commanded pose is {desired_pose_name}, guessed {guess}\n"
+    desired_pose = POSES.get(desired_pose_name, None)
+    if desired_pose is None:
+        msg += f"ERROR: {desired_pose_name} is not a valid pose.\n"
+        return msg
+    speculator.history.append(desired_pose_name)
+    msg += await asyncio.to_thread(robot.move, desired_pose.angles)
+    arrived = time.time() - start_time
+    if approach_task is None:
+        speculator.stats.controls += 1
+        speculator.stats.control_time += arrived
+    else:
+        speculator.stats.hits += desired_pose_name == guess
+        speculator.stats.speculative_time += arrived
+    return msg
+
+# Commands arriving within this window share one llm call
+BATCH_WINDOW: float = 0.1
+MAX_BATCH_SIZE: int = 8
+BATCH_TOKENS_PER_COMMAND: int = 8 # completion tokens allowed per answer line
+
+@dataclass
+class BatchStats:
+    batches: int = 0 # llm calls made for batches of two or more
+    commands: int = 0 # commands submitted
+    fallbacks: int = 0 # commands the batch reply missed, asked again on their own
+
+class MoveBatcher:
+    # Collects bursts of move commands into one numbered request and
+    # dispatches the answers in the order the commands were submitted
+
+    def __init__(
+        self,
+        robot: Robot,
+        llm_func: callable,
+        batch_window: float = BATCH_WINDOW,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        system_msg: str = SYSTEM_PROMPT,
+        move_msg: str = MOVE_MSG,
+        batch_msg: str = BATCH_MSG,
+    ):
+        self.robot = robot
+        self.llm_func = llm_func
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.system_msg = system_msg
+        self.move_msg = move_msg
+        self.batch_msg = batch_msg
+        self.stats = BatchStats()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> "MoveBatcher":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        # Dispatches everything already submitted first
+        await self._queue.join()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def submit(self, raw_move_str: str) -> str:
+        # Resolves once this command's move has run
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((raw_move_str, future))
+        self.stats.commands += 1
+        return await future
+
+    async def _ask(self, raw_move_strs: List[str]) -> List[Optional[str]]:
+        prompt = batch_prompt(self.system_msg, self.move_msg, self.batch_msg)
+        user = format_batch(raw_move_strs)
+        log.debug(f"Batch of {len(raw_move_strs)} prompt budget {prompt.budget(user)}")
+        reply = self.llm_func(
+            max_tokens=BATCH_TOKENS_PER_COMMAND * len(raw_move_strs),
+            messages=prompt.messages(user),
+            stop=None, # answers span several lines
+        )
+        if asyncio.iscoroutine(reply):
+            reply = await reply
+        self.stats.batches += 1
+        return parse_batch(reply, len(raw_move_strs))
+
+    async def _run(self) -> None:
+        while True:
+            batch = await next_batch(self._queue, self.max_batch_size, self.batch_window)
+            try:
+                raw_move_strs = [raw for raw, _ in batch]
+                if len(batch) > 1:
+                    pose_names = await self._ask(raw_move_strs)
+                else:
+                    pose_names = [None]
+                for (raw_move_str, future), pose_name in zip(batch, pose_names):
+                    if pose_name is None:
+                        # A lone command, or one the batch reply missed, goes through the normal prompt
+                        if len(batch) > 1:
+                            self.stats.fallbacks += 1
+                        msg = await move_with_prompt(
+                            self.robot, self.llm_func, raw_move_str, self.system_msg, self.move_msg
+                        )
+                    else:
+                        msg = f"{MOVE_TOKEN} commanded pose is {pose_name}\n"
+                        msg += await asyncio.to_thread(self.robot.move, POSES[pose_name].angles)
+                    if not future.done():
+                        future.set_result(msg)
+            except Exception as e:
+                log.error(f"Batch of {len(batch)} commands failed with exception {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+def test_batch_parse() -> None:
+    reply = "1. home\n2) face_down\nthree. forward\n4. banana\n"
+    assert parse_batch(reply, 4) == ["home", "face_down", None, None]
+    assert format_batch(["look up", "look\ndown"]) == "1. look up\n2. look down"
+
 def test_servos() -> None:
     log.setLevel(logging.DEBUG)
     log.debug("Testing move")
@@ -288,18 +656,94 @@ def test_servos_llm() -> None:
     log.setLevel(logging.DEBUG)
     log.debug("Testing move with prompt")
     robot = Robot()
-    from .gpt import gpt_text
+    from .gpt import gpt_text_async, run_with_client
+    classifier = make_pose_classifier()
     for raw_move_str in [
         "go to the home position",
         "check on your left",
         "bogie on your right",
         "what is on the floor",
     ]:
-        msg = move_with_prompt(robot, gpt_text, raw_move_str)
+        msg = run_with_client(move_with_prompt(robot, gpt_text_async, raw_move_str, classifier=classifier))
+        print(msg)
+        time.sleep(1)
+    del robot
+
+def test_servos_llm_streaming() -> None:
+    log.setLevel(logging.DEBUG)
+    log.debug("Testing move with streaming prompt")
+    robot = Robot()
+    from .gpt import gpt_stream_async, run_with_client
+    for raw_move_str in [
+        "go to the home position",
+        "check on your left",
+        "what is on the floor",
+    ]:
+        msg = run_with_client(move_with_prompt_streaming(robot, gpt_stream_async, raw_move_str))
+        print(msg)
+        time.sleep(1)
+    del robot
+
+def test_servos_policy() -> None:
+    log.setLevel(logging.DEBUG)
+    log.debug("Testing move with a hedged, deadline bound llm")
+    robot = Robot()
+    from functools import partial
+    from .gpt import gpt_text_async, run_with_client
+    policy = make_move_policy(partial(gpt_text_async, cache=None), make_pose_classifier())
+    for raw_move_str in [
+        "go to the home position",
+        "check on your left",
+        "what is on the floor",
+    ]:
+        msg = run_with_client(move_with_prompt(robot, policy, raw_move_str))
+        print(msg)
+        time.sleep(1)
+    print(f"Policy {policy.stats}, hedge delay {policy.hedge_delay:.3f} seconds")
+    del robot
+
+def test_servos_batch() -> None:
+    log.setLevel(logging.DEBUG)
+    log.debug("Testing batched moves")
+    robot = Robot()
+    from .gpt import gpt_text_async, run_with_client
+
+    async def burst() -> List[str]:
+        batcher = await MoveBatcher(robot, gpt_text_async).start()
+        msgs = await asyncio.gather(*[
+            batcher.submit(raw_move_str)
+            for raw_move_str in ["go to the home position", "check on your left", "what is on the floor"]
+        ])
+        await batcher.stop()
+        print(f"Batching {batcher.stats}")
+        return msgs
+
+    for msg in run_with_client(burst()):
+        print(msg)
+    del robot
+
+def test_servos_speculation() -> None:
+    log.setLevel(logging.DEBUG)
+    log.debug("Testing move with speculation")
+    robot = Robot()
+    from .gpt import gpt_text_async, run_with_client
+    speculator = Speculator(make_pose_classifier())
+    for raw_move_str in [
+        "go to the home position",
+        "check on your left",
+        "what is on the floor",
+    ]:
+        msg = run_with_client(move_with_speculation(robot, gpt_text_async, raw_move_str, speculator))
         print(msg)
         time.sleep(1)
+    print(f"Speculation {speculator.stats}, hit rate {speculator.stats.hit_rate:.2f}, saved {speculator.stats.saved:.3f} s")
     del robot
 
 if __name__ == "__main__":
+    test_batch_parse()
     test_servos()
     test_servos_llm()
+    test_servos_llm_streaming()
+    test_servos_policy()
+    test_servos_batch()
+    test_servos_speculation()
@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_PATH = os.path.join(ROOT_DIR, ".cache", "gpt.sqlite")
+MEMORY_ENTRIES = 256  # replies kept in the in-memory LRU
+MAX_ENTRIES = 10000  # replies kept on disk, least recently used are evicted
+TTL = timedelta(days=7)  # replies older than this are recomputed
+EVICT_EVERY = 100  # writes between disk evictions
+TOUCH_EVERY = 64  # memory hits between writes of their access times to disk
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS replies (
+    key TEXT PRIMARY KEY,
+    reply TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replies_accessed ON replies (accessed);
+"""
+
+
+def cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    stop: Optional[List[str]],
+) -> str:
+    # Canonical json so dict ordering and whitespace never change the key
+    canonical = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stop": stop,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(
+        self,
+        path: str = CACHE_PATH,
+        memory_entries: int = MEMORY_ENTRIES,
+        max_entries: int = MAX_ENTRIES,
+        ttl: timedelta = TTL,
+    ):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl = ttl.total_seconds()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.shared: int = 0  # requests that waited on an identical in-flight request
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (reply, created)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_async: Dict[str, asyncio.Task] = {}
+        self._writes: int = 0
+        self._touched: Dict[str, float] = {}  # key -> access time of memory hits not yet on disk
+        self._db: Optional[sqlite3.Connection] = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Opened on first use, so importing a module with a default cache creates no files
+        if self._db is None:
+            with self._open_lock:
+                if self._db is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    db = sqlite3.connect(self.path, check_same_thread=False)
+                    db.executescript(SCHEMA)
+                    self._db = db
+        return self._db
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "hit_rate": self.hit_rate,
+            "memory_entries": len(self._memory),
+        }
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                reply, created = self._memory[key]
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    # Disk eviction goes by access time, so memory hits are written back in batches
+                    self._touched[key] = now
+                    if len(self._touched) >= TOUCH_EVERY:
+                        self._flush_touched()
+                    return reply
+                del self._memory[key]
+            row = self.db.execute(
+                "SELECT reply, created FROM replies WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return None
+            with self.db:
+                self.db.execute("UPDATE replies SET accessed = ? WHERE key = ?", (now, key))
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+    def put(self, key: str, reply: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, reply, now)
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO replies (key, reply, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, reply, now, now),
+                )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _remember(self, key: str, reply: str, created: float) -> None:
+        self._memory[key] = (reply, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self) -> None:
+        if not self._touched:
+            return
+        with self.db:
+            self.db.executemany(
+                "UPDATE replies SET accessed = MAX(accessed, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()],
+            )
+        self._touched.clear()
+
+    def _evict(self, now: float) -> None:
+        self._flush_touched()
+        with self.db:
+            self.db.execute("DELETE FROM replies WHERE created < ?", (now - self.ttl,))
+            self.db.execute(
+                "DELETE FROM replies WHERE key IN "
+                "(SELECT key FROM replies ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        # Identical concurrent calls from other threads wait for the first one
+        reply = self.get(key)
+        with self._lock:
+            if reply is not None:
+                self.hits += 1
+                return reply
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+                self.hits += 1
+        if not leader:
+            return future.result()
+        try:
+            reply = compute()
+            self.put(key, reply)
+            future.set_result(reply)
+            return reply
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    async def get_or_compute_async(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        # Same as get_or_compute for coroutines. The request runs in a task
+        # owned by the cache, so cancelling any caller, the first included,
+        # leaves the others waiting on it.
+        reply = self.get(key)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if reply is not None:
+                self.hits += 1
+                return reply
+            task = self._inflight_async.get(key)
+            if task is None or task.get_loop() is not loop:
+                task = self._inflight_async[key] = loop.create_task(self._compute_async(key, compute))
+                # Nobody may be left to retrieve the exception if every caller was cancelled
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                self.misses += 1
+            else:
+                self.shared += 1
+                self.hits += 1
+        return await asyncio.shield(task)
+
+    async def _compute_async(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        try:
+            reply = await compute()
+            self.put(key, reply)
+            return reply
+        finally:
+            with self._lock:
+                if self._inflight_async.get(key) is asyncio.current_task():
+                    del self._inflight_async[key]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._flush_touched()
+                self._db.close()
+                self._db = None
+
+
+def test_cache() -> None:
+    log.setLevel(logging.DEBUG)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "gpt.sqlite")
+        cache = ResponseCache(path, memory_entries=2)
+        assert not os.path.exists(path)
+        messages = [{"role": "user", "content": "look down"}]
+        key = cache_key("gpt-3.5-turbo", messages, 0, 8, ["\n"])
+        assert key == cache_key("gpt-3.5-turbo", [{"content": "look down", "role": "user"}], 0, 8, ["\n"])
+        calls = []
+
+        def slow_llm() -> str:
+            calls.append(1)
+            time.sleep(0.1)
+            return "face_down"
+
+        threads = [threading.Thread(target=cache.get_or_compute, args=(key, slow_llm)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1, calls
+
+        async def async_llm() -> str:
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "home"
+
+        async def burst() -> List[str]:
+            other = cache_key("gpt-3.5-turbo", messages, 0, 16, ["\n"])
+            return await asyncio.gather(*[cache.get_or_compute_async(other, async_llm) for _ in range(8)])
+
+        assert asyncio.run(burst()) == ["home"] * 8 and len(calls) == 2
+
+        async def cancel_leader() -> str:
+            # A cancelled first caller must not cancel the callers sharing its request
+            third = cache_key("gpt-3.5-turbo", messages, 0, 24, ["\n"])
+            leader = asyncio.ensure_future(cache.get_or_compute_async(third, async_llm))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(cache.get_or_compute_async(third, async_llm))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        assert asyncio.run(cancel_leader()) == "home" and len(calls) == 3
+        cache.close()
+        # Replies survive a restart through the sqlite store
+        cache = ResponseCache(path)
+        assert cache.get_or_compute(key, slow_llm) == "face_down" and len(calls) == 3
+        # Memory hits still move the entry up in the disk eviction order
+        accessed = cache.db.execute("SELECT accessed FROM replies WHERE key = ?", (key,)).fetchone()[0]
+        time.sleep(0.01)
+        assert cache.get(key) == "face_down"
+        cache.close()
+        cache = ResponseCache(path)
+        assert cache.db.execute("SELECT accessed FROM replies WHERE key = ?", (key,)).fetchone()[0] > accessed
+        log.debug(f"Cache stats {cache.stats()}")
+        cache.close()
+
+
+if __name__ == "__main__":
+    test_cache()
@@ -1,7 +1,23 @@
 import asyncio
 import os
-from dataclasses import dataclass
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 import logging
+from typing import Deque, Dict, List, Optional, Union
+
+import cv2
+import numpy as np
+import simplejpeg
+
+from .frame import Frame
+from .metrics import CameraStats, camera_stats, camera_summary
+from .motion import MotionGate
+from .store import CaptureStore
+from .transfer import SSHTransport, TransferQueue
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -12,6 +28,16 @@ REMOTE_USERNAME = "oop"
 REMOTE_IP = "192.168.1.44"
 VIDEO_DURATION = 3
 VIDEO_FPS = 30
+RING_SIZE = 8  # compressed frames kept per stream
+READ_CHUNK = 1 << 16  # bytes read from the ffmpeg pipe at a time
+JPEG_EOI = b"\xff\xd9"  # end of image marker
+MOTION_DECODE_SCALE = 4  # frames are decoded this many times smaller for the motion gate
+ENCODE_WORKERS = 2  # threads encoding stills
+ENCODE_MAX_PENDING = 4  # frames waiting on or in the encoder before callers wait
+JPEG_QUALITY = 85
+PNG_COMPRESSION = 1  # zlib level, low is much faster on the Pi for little size
+DEFAULT_CODEC = "jpeg"
+CODEC_EXTENSIONS: Dict[str, str] = {"jpeg": "jpg", "png": "png"}
 
 
 @dataclass
@@ -21,6 +47,7 @@ class Camera:
     width: int
     height: int
     desc: str
+    input_format: Optional[str] = None  # v4l2 input format, negotiated on first capture, "" lets ffmpeg choose
 
 
 CAMERAS = [
@@ -41,15 +68,254 @@ CAMERAS = [
 ]
 
 
+def _input_args(camera: Camera) -> List[str]:
+    args = ["-f", "v4l2"]
+    if camera.input_format:
+        args += ["-input_format", camera.input_format]
+    return args + ["-video_size", f"{camera.width}x{camera.height}"]
+
+
+async def negotiate_format(camera: Camera, preferred: str = "mjpeg") -> str:
+    # Ask the device which formats it offers at the camera size, prefer the
+    # compressed one and fall back to whatever raw format it supports
+    cmd = ["ffmpeg", "-hide_banner", "-f", "v4l2", "-list_formats", "all", "-i", camera.device]
+    log.debug(f"Running command: {cmd}")
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    size = f"{camera.width}x{camera.height}"
+    formats: Dict[str, bool] = {}  # format name -> is compressed
+    for line in stderr.decode(errors="ignore").splitlines():
+        match = re.search(r"(Compressed|Raw)\s*:\s*(\w+)\s*:.*:\s*(.*)$", line)
+        if match and size in match.group(3).split():
+            formats[match.group(2)] = match.group(1) == "Compressed"
+    if preferred in formats:
+        camera.input_format = preferred
+    elif formats:
+        raw = [name for name, compressed in formats.items() if not compressed]
+        camera.input_format = raw[0] if raw else next(iter(formats))
+    else:
+        log.warning(f"Could not negotiate a format for {camera.name} at {size}, using the default")
+        camera.input_format = ""
+    log.debug(f"Negotiated {camera.name} input format {camera.input_format or 'default'}")
+    return camera.input_format
+
+
+async def camera_format(camera: Camera) -> str:
+    # Formats are negotiated once, the first time a camera is captured from
+    if camera.input_format is None:
+        await negotiate_format(camera)
+    return camera.input_format
+
+
+@dataclass
+class CompressedFrame:
+    data: bytes  # jpeg bytes exactly as they came off the camera
+    camera: str  # name of the camera
+    seq: int  # frame number within the stream
+    timestamp: float = field(default_factory=time.monotonic)
+    _decoded: Dict[int, np.ndarray] = field(default_factory=dict, repr=False)
+
+    def decode(self, scale: int = 1) -> np.ndarray:
+        # Pixels are only decoded when asked for. libjpeg can decode at 1/2,
+        # 1/4 and 1/8 scale in the DCT, which is much cheaper than a full
+        # decode followed by a resize.
+        if scale not in self._decoded:
+            width, height = simplejpeg.decode_jpeg_header(self.data)[:2]
+            self._decoded[scale] = simplejpeg.decode_jpeg(
+                self.data,
+                colorspace="RGB",
+                min_width=width // scale,
+                min_height=height // scale,
+            )
+        return self._decoded[scale]
+
+    def save(self, path: str) -> str:
+        with open(path, "wb") as f:
+            f.write(self.data)
+        return path
+
+
+class CompressedStream:
+
+    def __init__(
+        self,
+        camera: Camera,
+        fps: int = VIDEO_FPS,
+        ring_size: int = RING_SIZE,
+    ):
+        self.camera = camera
+        self.fps = fps
+        self.ring: Deque[CompressedFrame] = deque(maxlen=ring_size)
+        self.seq: int = 0
+        # Frames are timestamped when they leave the pipe, so latency does not
+        # include the time spent in the driver and in ffmpeg
+        self.stats: CameraStats = camera_stats(camera.name, fps)
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> "CompressedStream":
+        # The camera's mjpeg packets are copied into the pipe without decoding,
+        # raw cameras are encoded to mjpeg by ffmpeg
+        compressed = await camera_format(self.camera) == "mjpeg"
+        cmd = [
+            "ffmpeg", "-loglevel", "error",
+            *_input_args(self.camera),
+            "-framerate", str(self.fps),
+            "-i", self.camera.device,
+            "-c:v", "copy" if compressed else "mjpeg",
+            "-f", "mjpeg",
+            "pipe:",
+        ]
+        log.debug(f"Running command: {cmd}")
+        self._process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        self._task = asyncio.create_task(self._read())
+        return self
+
+    async def stop(self) -> None:
+        if self._process is not None and self._process.returncode is None:
+            self._process.terminate()
+            await self._process.wait()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def latest(self) -> Optional[CompressedFrame]:
+        return self.ring[-1] if self.ring else None
+
+    async def _read(self) -> None:
+        buffer = bytearray()
+        while True:
+            chunk = await self._process.stdout.read(READ_CHUNK)
+            if not chunk:
+                log.warning(f"Stream from {self.camera.name} ended")
+                return
+            start = max(len(buffer) - 1, 0)  # marker may straddle chunks
+            buffer += chunk
+            while True:
+                end = buffer.find(JPEG_EOI, start)
+                if end < 0:
+                    break
+                end += len(JPEG_EOI)
+                frame = CompressedFrame(bytes(buffer[:end]), self.camera.name, self.seq)
+                self.stats.frame(frame.timestamp, len(frame.data))
+                self.ring.append(frame)
+                self.seq += 1
+                del buffer[:end]
+                start = 0
+
+
+class FrameEncoder:
+    # Encodes RGB frames from memory on a small thread pool. Both simplejpeg
+    # and cv2 release the GIL while encoding, so capture and control keep
+    # running while a still is being compressed.
+
+    def __init__(
+        self,
+        workers: int = ENCODE_WORKERS,
+        max_pending: int = ENCODE_MAX_PENDING,
+        quality: int = JPEG_QUALITY,
+        png_compression: int = PNG_COMPRESSION,
+    ):
+        self.quality = quality
+        self.png_compression = png_compression
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode")
+        # Semaphores bind to the loop they first wait in, so each running loop gets its own
+        self._pending: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._local = threading.local()  # per thread scratch buffers
+
+    def _buffer(self, name: str, image: np.ndarray) -> np.ndarray:
+        # Scratch buffers are reused across frames of the same shape
+        buffer = getattr(self._local, name, None)
+        if buffer is None or buffer.shape != image.shape:
+            buffer = np.empty(image.shape, np.uint8)
+            setattr(self._local, name, buffer)
+        return buffer
+
+    def encode_sync(
+        self,
+        image: Union[np.ndarray, Frame],
+        codec: str = DEFAULT_CODEC,
+        quality: Optional[int] = None,
+    ) -> bytes:
+        if isinstance(image, Frame):
+            # BGR frames become a strided view here, packing it is the only copy
+            image = image.view("RGB")
+        if codec == "jpeg":
+            if not image.flags.c_contiguous:
+                # Views such as stereo halves are packed before encoding
+                packed = self._buffer("packed", image)
+                np.copyto(packed, image)
+                image = packed
+            return simplejpeg.encode_jpeg(
+                image, quality=quality or self.quality, colorspace="RGB", fastdct=True
+            )
+        if codec == "png":
+            bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=self._buffer("bgr", image))
+            ok, data = cv2.imencode(".png", bgr, [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression])
+            if not ok:
+                raise RuntimeError("Failed to encode png")
+            return data.tobytes()
+        raise ValueError(f"Unknown codec {codec}, expected one of {list(CODEC_EXTENSIONS)}")
+
+    async def encode(
+        self,
+        image: Union[np.ndarray, Frame],
+        codec: str = DEFAULT_CODEC,
+        quality: Optional[int] = None,
+    ) -> bytes:
+        loop = asyncio.get_running_loop()
+        if loop not in self._pending:
+            for closed in [other for other in self._pending if other.is_closed()]:
+                del self._pending[closed]
+            self._pending[loop] = asyncio.Semaphore(self.max_pending)
+        async with self._pending[loop]:
+            return await loop.run_in_executor(self._executor, self.encode_sync, image, codec, quality)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+ENCODER = FrameEncoder()  # threads are only started on the first encode
+
+
+def make_transfer_queue(
+    remote_dir_path: str = REMOTE_DATA_DIR,
+    username: str = REMOTE_USERNAME,
+    remote_ip: str = REMOTE_IP,
+    compress: bool = False,
+    store: Optional[CaptureStore] = None,
+) -> TransferQueue:
+    queue = TransferQueue(
+        SSHTransport(username, remote_ip, remote_dir_path, compress=compress),
+        on_sent=store.mark_sent if store is not None else None,
+    )
+    if store is not None:
+        # Artifacts whose transfer was dropped or never finished go first
+        for path in store.unsent():
+            queue.enqueue(path)
+    return queue
+
+
 async def send_file(
     filename: str,
     robot_dir_path: str = ROBOT_DATA_DIR,
     remote_dir_path: str = REMOTE_DATA_DIR,
     username: str = REMOTE_USERNAME,
     remote_ip: str = REMOTE_IP,
+    queue: Optional[TransferQueue] = None,
 ) -> str:
     msg: str = ""
     local_path = os.path.join(robot_dir_path, filename)
+    if queue is not None:
+        # Returns right away, the queue batches the upload over its connection
+        queue.enqueue(local_path)
+        msg += f"Queued {local_path} for transfer\n"
+        return msg
     remote_path = os.path.join(remote_dir_path, filename)
     cmd = ["scp", local_path, f"{username}@{remote_ip}:{remote_path}"]
     log.debug(f"Running command: {cmd}")
@@ -63,22 +329,49 @@ async def send_file(
     return msg
 
 
+async def store_and_send(
+    filename: str,
+    camera: Camera,
+    event: str,
+    store: Optional[CaptureStore] = None,
+    queue: Optional[TransferQueue] = None,
+) -> str:
+    if store is None:
+        return await send_file(filename, queue=queue)
+    msg: str = ""
+    capture = store.add_file(os.path.join(ROBOT_DATA_DIR, filename), camera.name, event)
+    msg += f"Stored {filename} as {os.path.basename(capture.path)}\n"
+    if capture.sent:
+        # Identical bytes already reached the remote
+        msg += f"Skipped send of duplicate {capture.hash}\n"
+        return msg
+    msg += await send_file(
+        os.path.basename(capture.path),
+        robot_dir_path=os.path.dirname(capture.path),
+        queue=queue,
+    )
+    return msg
+
+
 async def record_video(
     camera: Camera,
     duration: int = VIDEO_DURATION,
     fps: int = VIDEO_FPS,
+    queue: Optional[TransferQueue] = None,
+    store: Optional[CaptureStore] = None,
 ) -> str:
     msg: str = ""
-    output_filename = f"{camera.name}.mp4"
+    # Compressed streams are stored as they arrive, raw ones are encoded
+    compressed = await camera_format(camera) == "mjpeg"
+    output_filename = f"{camera.name}.{'avi' if compressed else 'mp4'}"
     output_path = os.path.join(ROBOT_DATA_DIR, output_filename)
     cmd = [
         "ffmpeg", "-y",
-        "-f", "v4l2",
+        *_input_args(camera),
         "-r", str(fps),
         "-t", str(duration),
-        "-video_size", f"{camera.width}x{camera.height}",
         "-i", camera.device,
-        "-c:v", "h264",
+        "-c:v", "copy" if compressed else "h264",
         output_path
     ]
     log.debug(f"Running command: {cmd}")
@@ -92,46 +385,132 @@ async def record_video(
         log.warning(_msg)
         msg += _msg
         return msg
-    msg += await send_file(output_filename)
+    msg += await store_and_send(output_filename, camera, "video", store=store, queue=queue)
     return msg
 
 
-async def take_image(camera: Camera) -> str:
+async def take_image(
+    camera: Camera,
+    queue: Optional[TransferQueue] = None,
+    store: Optional[CaptureStore] = None,
+    encoder: FrameEncoder = ENCODER,
+    codec: str = DEFAULT_CODEC,
+) -> str:
     msg: str = ""
-    output_filename = f"{camera.name}.png"
+    # Compressed cameras already produce jpeg bytes, raw frames are piped
+    # out of ffmpeg and encoded in memory
+    compressed = await camera_format(camera) == "mjpeg"
+    output_filename = f"{camera.name}.{'jpg' if compressed else CODEC_EXTENSIONS[codec]}"
     output_path = os.path.join(ROBOT_DATA_DIR, output_filename)
     cmd = [
-        "ffmpeg", "-y",
-        "-f", "v4l2",
-        "-video_size", f"{camera.width}x{camera.height}",
+        "ffmpeg", "-loglevel", "error",
+        *_input_args(camera),
         "-i", camera.device,
         "-vframes", "1",
-        output_path
+        *(["-c:v", "copy", "-f", "mjpeg"] if compressed else ["-f", "rawvideo", "-pix_fmt", "rgb24"]),
+        "pipe:",
     ]
     log.debug(f"Running command: {cmd}")
     process = await asyncio.create_subprocess_exec(
         *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
     stdout, stderr = await process.communicate()
-    msg += f"Captured image and saved as {output_filename}\n"
     if process.returncode != 0:
         _msg = f"ERROR on image capture: {stderr.decode()}"
         log.warning(_msg)
         msg += _msg
         return msg
-    msg += await send_file(output_filename)
+    if compressed:
+        data = stdout
+    else:
+        image = np.frombuffer(stdout, np.uint8).reshape(camera.height, camera.width, 3)
+        data = await encoder.encode(image, codec)
+    with open(output_path, "wb") as f:
+        f.write(data)
+    msg += f"Captured image and saved as {output_filename}\n"
+    msg += await store_and_send(output_filename, camera, "image", store=store, queue=queue)
+    return msg
+
+
+async def watch_motion(
+    stream: CompressedStream,
+    gate: MotionGate,
+    store: CaptureStore,
+    queue: Optional[TransferQueue] = None,
+    scale: int = MOTION_DECODE_SCALE,
+) -> None:
+    # Only frames that pass the gate are stored and sent, quiet frames cost
+    # a reduced scale decode and nothing else
+    last_seq: int = -1
+    while True:
+        frame = stream.latest()
+        if frame is None or frame.seq == last_seq:
+            await asyncio.sleep(1 / VIDEO_FPS)
+            continue
+        last_seq = frame.seq
+        stream.stats.consumed(frame.timestamp)
+        motion = gate.update(frame.decode(scale), frame.timestamp)
+        if not motion.moving:
+            continue
+        capture = store.add_bytes(frame.data, stream.camera.name, "motion", ".jpg")
+        # Duplicates are queued again until a transfer of them succeeds
+        if not capture.sent and queue is not None:
+            queue.enqueue(capture.path)
+
+
+async def bench_encoder(
+    image: Optional[np.ndarray] = None,
+    iterations: int = 20,
+    encoder: FrameEncoder = ENCODER,
+) -> str:
+    msg: str = ""
+    if image is None:
+        # Smooth gradients plus noise compress roughly like a real room
+        h, w = CAMERAS[0].height, CAMERAS[0].width
+        yy, xx = np.mgrid[0:h, 0:w]
+        image = np.stack([xx * 255 // w, yy * 255 // h, (xx + yy) * 255 // (w + h)], axis=-1)
+        image = (image + np.random.default_rng(0).integers(0, 16, image.shape)).clip(0, 255).astype(np.uint8)
+    for codec in CODEC_EXTENSIONS:
+        encoder.encode_sync(image, codec)  # warm up buffers and threads
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            data = encoder.encode_sync(image, codec)
+        serial = (time.perf_counter() - start_time) / iterations
+        start_time = time.perf_counter()
+        await asyncio.gather(*[encoder.encode(image, codec) for _ in range(iterations)])
+        pooled = (time.perf_counter() - start_time) / iterations
+        msg += f"{codec}: {serial * 1e3:.2f} ms/frame serial, {pooled * 1e3:.2f} ms/frame pooled, {len(data)} bytes/frame\n"
     return msg
 
 
 async def test_cameras():
     log.setLevel(logging.DEBUG)
     log.debug(f"Testing cameras: {CAMERAS}")
+    log.debug("Testing negotiate_format")
+    for camera in CAMERAS:
+        await negotiate_format(camera)
+    store = CaptureStore(ROBOT_DATA_DIR)
+    queue = await make_transfer_queue(store=store).start()
     log.debug("Testing take_image")
-    image_tasks = [take_image(camera) for camera in CAMERAS]
+    image_tasks = [take_image(camera, queue=queue, store=store) for camera in CAMERAS]
     _ = await asyncio.gather(*image_tasks, return_exceptions=True)
     log.debug("Testing record_video")
-    video_tasks = [record_video(camera) for camera in CAMERAS]
+    video_tasks = [record_video(camera, queue=queue, store=store) for camera in CAMERAS]
     _ = await asyncio.gather(*video_tasks, return_exceptions=True)
+    await queue.stop()
+    log.debug(f"Transfers: {queue.stats}")
+    for camera in CAMERAS:
+        log.debug(f"Captures from {camera.name}: {store.query(camera=camera.name)}")
+    log.debug("Testing CompressedStream")
+    streams = [await CompressedStream(camera).start() for camera in CAMERAS]
+    await asyncio.sleep(1)
+    for stream in streams:
+        frame = stream.latest()
+        if frame is not None:
+            stream.stats.consumed(frame.timestamp)
+            log.debug(f"{stream.camera.name} frame {frame.seq} {len(frame.data)} bytes, decoded at 1/2 {frame.decode(2).shape}")
+        await stream.stop()
+    log.debug(f"Camera metrics:\n{camera_summary()}")
 
 
 if __name__ == "__main__":
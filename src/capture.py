@@ -0,0 +1,294 @@
+import abc
+import fcntl
+import logging
+import mmap
+import os
+import select
+import subprocess
+import time
+from typing import Dict, List, Optional, Type
+
+import cv2
+import numpy as np
+
+from .cam import CAMERAS, VIDEO_FPS, Camera
+from .frame import Frame
+from .metrics import CameraStats, camera_stats
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+NUM_BUFFERS = 4  # frame buffers each backend rotates through
+V4L2_TIMEOUT = 2.0  # seconds to wait for the driver to fill a buffer
+
+
+class CaptureBackend(abc.ABC):
+    # Blocking frame source. read() returns a Frame whose pixels live in a
+    # backend owned buffer that stays valid for the next NUM_BUFFERS - 1 reads.
+
+    def __init__(
+        self,
+        camera: Camera,
+        fps: int = VIDEO_FPS,
+        num_buffers: int = NUM_BUFFERS,
+    ):
+        self.camera = camera
+        self.fps = fps
+        self.num_buffers = num_buffers
+        self.seq: int = 0
+        self.stats: CameraStats = camera_stats(camera.name, fps)
+
+    def open(self) -> "CaptureBackend":
+        return self
+
+    @abc.abstractmethod
+    def read(self) -> Frame:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "CaptureBackend":
+        return self.open()
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _buffers(self, channels: int = 3) -> List[np.ndarray]:
+        shape = (self.camera.height, self.camera.width, channels)
+        return [np.empty(shape, np.uint8) for _ in range(self.num_buffers)]
+
+
+class FFmpegPipeBackend(CaptureBackend):
+    # One long running ffmpeg decoding to rgb24, frames are read straight
+    # into rotating buffers with readinto
+
+    def open(self) -> "FFmpegPipeBackend":
+        cmd = [
+            "ffmpeg", "-loglevel", "error",
+            "-f", "v4l2",
+            *(["-input_format", self.camera.input_format] if self.camera.input_format else []),
+            "-video_size", f"{self.camera.width}x{self.camera.height}",
+            "-framerate", str(self.fps),
+            "-i", self.camera.device,
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "pipe:",
+        ]
+        log.debug(f"Running command: {cmd}")
+        self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._frames = self._buffers()
+        return self
+
+    def read(self) -> Frame:
+        pixels = self._frames[self.seq % self.num_buffers]
+        view = memoryview(pixels).cast("B")
+        filled = 0
+        while filled < len(view):
+            n = self._process.stdout.readinto(view[filled:])
+            if not n:
+                raise RuntimeError(f"ffmpeg stream from {self.camera.device} ended")
+            filled += n
+        frame = Frame(pixels, "RGB", self.camera.name, seq=self.seq)
+        self.seq += 1
+        self.stats.frame(frame.timestamp, len(view))
+        return frame
+
+    def close(self) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+
+class V4L2MmapBackend(CaptureBackend):
+    # Streams straight from the driver with mmap'd buffers. read_raw() hands
+    # out a view of the dequeued driver buffer (zero copy) which is queued
+    # back on the next read. read() converts YUYV into a reused RGB buffer.
+
+    def open(self) -> "V4L2MmapBackend":
+        import v4l2  # only available on the Pi
+
+        self._v4l2 = v4l2
+        self._fd = os.open(self.camera.device, os.O_RDWR | os.O_NONBLOCK)
+        fmt = v4l2.v4l2_format()
+        fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        fmt.fmt.pix.width = self.camera.width
+        fmt.fmt.pix.height = self.camera.height
+        fmt.fmt.pix.pixelformat = v4l2.V4L2_PIX_FMT_YUYV
+        fmt.fmt.pix.field = v4l2.V4L2_FIELD_ANY
+        fcntl.ioctl(self._fd, v4l2.VIDIOC_S_FMT, fmt)
+        # The driver writes back the closest format it supports, the buffer
+        # views below assume exactly the requested size in packed YUYV
+        actual = fmt.fmt.pix
+        if (actual.width, actual.height, actual.pixelformat) != (
+            self.camera.width, self.camera.height, v4l2.V4L2_PIX_FMT_YUYV
+        ) or actual.bytesperline not in (0, self.camera.width * 2):
+            os.close(self._fd)
+            raise RuntimeError(
+                f"{self.camera.device} gave {actual.width}x{actual.height} format {actual.pixelformat:#x} "
+                f"stride {actual.bytesperline}, expected {self.camera.width}x{self.camera.height} YUYV"
+            )
+        parm = v4l2.v4l2_streamparm()
+        parm.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        parm.parm.capture.timeperframe.numerator = 1
+        parm.parm.capture.timeperframe.denominator = self.fps
+        fcntl.ioctl(self._fd, v4l2.VIDIOC_S_PARM, parm)
+        req = v4l2.v4l2_requestbuffers()
+        req.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        req.memory = v4l2.V4L2_MEMORY_MMAP
+        req.count = self.num_buffers
+        fcntl.ioctl(self._fd, v4l2.VIDIOC_REQBUFS, req)
+        self._maps: List[mmap.mmap] = []
+        self._views: List[np.ndarray] = []
+        for index in range(req.count):
+            buf = self._buffer(index)
+            fcntl.ioctl(self._fd, v4l2.VIDIOC_QUERYBUF, buf)
+            mapped = mmap.mmap(self._fd, buf.length, mmap.MAP_SHARED, mmap.PROT_READ, offset=buf.m.offset)
+            self._maps.append(mapped)
+            self._views.append(
+                np.frombuffer(mapped, np.uint8, self.camera.width * self.camera.height * 2).reshape(
+                    self.camera.height, self.camera.width, 2
+                )
+            )
+            fcntl.ioctl(self._fd, v4l2.VIDIOC_QBUF, buf)
+        buf_type = v4l2.v4l2_buf_type(v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        fcntl.ioctl(self._fd, v4l2.VIDIOC_STREAMON, buf_type)
+        self._dequeued: Optional[int] = None
+        self._frames = self._buffers()
+        return self
+
+    def _buffer(self, index: int):
+        buf = self._v4l2.v4l2_buffer()
+        buf.type = self._v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        buf.memory = self._v4l2.V4L2_MEMORY_MMAP
+        buf.index = index
+        return buf
+
+    def read_raw(self) -> Frame:
+        # The returned YUYV pixels alias a driver buffer, valid until the next read
+        if self._dequeued is not None:
+            fcntl.ioctl(self._fd, self._v4l2.VIDIOC_QBUF, self._buffer(self._dequeued))
+            self._dequeued = None
+        readable, _, _ = select.select([self._fd], [], [], V4L2_TIMEOUT)
+        if not readable:
+            raise RuntimeError(f"Timed out waiting for a frame from {self.camera.device}")
+        buf = self._buffer(0)
+        fcntl.ioctl(self._fd, self._v4l2.VIDIOC_DQBUF, buf)
+        self._dequeued = buf.index
+        # UVC timestamps come from the monotonic clock when the frame was captured
+        timestamp = buf.timestamp.secs + buf.timestamp.usecs * 1e-6
+        self.seq = buf.sequence
+        self.stats.frame(timestamp, buf.bytesused, seq=buf.sequence)
+        return Frame(self._views[buf.index], "YUYV", self.camera.name, timestamp=timestamp, seq=buf.sequence)
+
+    def read(self) -> Frame:
+        raw = self.read_raw()
+        pixels = self._frames[raw.seq % self.num_buffers]
+        cv2.cvtColor(raw.pixels, cv2.COLOR_YUV2RGB_YUYV, dst=pixels)
+        return Frame(pixels, "RGB", raw.camera, timestamp=raw.timestamp, seq=raw.seq)
+
+    def close(self) -> None:
+        buf_type = self._v4l2.v4l2_buf_type(self._v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        fcntl.ioctl(self._fd, self._v4l2.VIDIOC_STREAMOFF, buf_type)
+        self._views.clear()
+        for mapped in self._maps:
+            mapped.close()
+        os.close(self._fd)
+
+
+class SyntheticBackend(CaptureBackend):
+    # Moving test pattern, or replay of a video file when source is given.
+    # Paced to fps when realtime, otherwise as fast as frames can be made.
+
+    def __init__(
+        self,
+        camera: Camera,
+        fps: int = VIDEO_FPS,
+        num_buffers: int = NUM_BUFFERS,
+        source: Optional[str] = None,
+        realtime: bool = True,
+    ):
+        super().__init__(camera, fps, num_buffers)
+        self.source = source
+        self.realtime = realtime
+
+    def open(self) -> "SyntheticBackend":
+        self._frames = self._buffers()
+        self._capture = cv2.VideoCapture(self.source) if self.source else None
+        h, w = self.camera.height, self.camera.width
+        yy, xx = np.mgrid[0:h, 0:w]
+        self._pattern = np.stack(
+            [xx * 255 // w, yy * 255 // h, np.full((h, w), 128)], axis=-1
+        ).astype(np.uint8)
+        self._next_time = time.monotonic()
+        return self
+
+    def read(self) -> Frame:
+        if self.realtime:
+            self._next_time += 1 / self.fps
+            delay = self._next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        pixels = self._frames[self.seq % self.num_buffers]
+        order = "RGB"
+        if self._capture is not None:
+            ok, image = self._capture.read(pixels)
+            if not ok:
+                # Loop the file
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, image = self._capture.read(pixels)
+                if not ok:
+                    raise RuntimeError(f"Failed to read frame from {self.source}")
+            if image is not pixels:
+                # File is not at the camera size
+                cv2.resize(image, (self.camera.width, self.camera.height), dst=pixels)
+            order = "BGR"
+        else:
+            pixels[...] = self._pattern
+            bar = (self.seq * 8) % self.camera.width
+            pixels[:, bar:bar + 16] = 255
+        frame = Frame(pixels, order, self.camera.name, seq=self.seq)
+        self.seq += 1
+        self.stats.frame(frame.timestamp, pixels.nbytes)
+        return frame
+
+    def close(self) -> None:
+        if self._capture is not None:
+            self._capture.release()
+
+
+BACKENDS: Dict[str, Type[CaptureBackend]] = {
+    "ffmpeg": FFmpegPipeBackend,
+    "v4l2": V4L2MmapBackend,
+    "synthetic": SyntheticBackend,
+}
+
+
+def open_backend(camera: Camera, kind: str = "ffmpeg", **kwargs) -> CaptureBackend:
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown capture backend {kind}, expected one of {list(BACKENDS)}")
+    return BACKENDS[kind](camera, **kwargs).open()
+
+
+def bench_backend(backend: CaptureBackend, num_frames: int = 100) -> str:
+    msg: str = ""
+    backend.read()  # first frame includes device start up
+    start_time = time.perf_counter()
+    for _ in range(num_frames):
+        backend.read()
+    elapsed = time.perf_counter() - start_time
+    msg += f"{type(backend).__name__} {backend.camera.name}: "
+    msg += f"{num_frames / elapsed:.1f} fps, {elapsed / num_frames * 1e3:.2f} ms/frame\n"
+    return msg
+
+
+def test_capture(kind: str = "synthetic") -> None:
+    log.setLevel(logging.DEBUG)
+    for camera in CAMERAS:
+        kwargs = {"realtime": False} if kind == "synthetic" else {}
+        with open_backend(camera, kind, **kwargs) as backend:
+            frame = backend.read()
+            assert frame.shape == (camera.height, camera.width, 3)
+            log.debug(bench_backend(backend))
+
+
+if __name__ == "__main__":
+    test_capture()
@@ -0,0 +1,58 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+CHANNEL_ORDERS = ("RGB", "BGR", "YUYV")  # YUYV frames are (H, W, 2) and need a conversion
+
+
+@dataclass
+class Frame:
+    pixels: np.ndarray  # uint8 buffer exactly as the capture produced it
+    order: str  # channel order of pixels, one of CHANNEL_ORDERS
+    camera: str  # name of the camera
+    timestamp: float = field(default_factory=time.monotonic)
+    seq: Optional[int] = None  # frame number within the capture, if known
+
+    def __post_init__(self):
+        if self.order not in CHANNEL_ORDERS:
+            raise ValueError(f"Unknown channel order {self.order}, expected one of {CHANNEL_ORDERS}")
+
+    def view(self, order: str = "RGB") -> np.ndarray:
+        # Channels are swapped with a negative stride view, no pixels are
+        # copied. The consumer's next op (resize, normalize, encode) is the
+        # one copy the frame gets.
+        if order == self.order:
+            return self.pixels
+        if {order, self.order} == {"RGB", "BGR"}:
+            return self.pixels[..., ::-1]
+        raise ValueError(f"Cannot view {self.order} pixels as {order}")
+
+    def to(self, order: str = "RGB") -> np.ndarray:
+        # Contiguous copy in the requested order, for consumers that need one
+        return np.ascontiguousarray(self.view(order))
+
+    @property
+    def shape(self):
+        return self.pixels.shape
+
+
+def test_frame() -> None:
+    log.setLevel(logging.DEBUG)
+    bgr = np.zeros((2, 2, 3), np.uint8)
+    bgr[..., 0] = 255  # blue
+    frame = Frame(bgr, "BGR", "test")
+    rgb = frame.view("RGB")
+    assert np.shares_memory(rgb, bgr) and rgb[0, 0, 2] == 255
+    assert frame.view("BGR") is bgr
+    assert frame.to("RGB").flags.c_contiguous
+    log.debug(f"{frame}")
+
+
+if __name__ == "__main__":
+    test_frame()
@@ -1,12 +1,124 @@
+import asyncio
 import logging
 import os
-from typing import Dict, List, Tuple
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 
-from openai import OpenAI
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from .cache import ResponseCache, cache_key
+from .metrics import LLM_STATS, LLMCall
 
 log = logging.getLogger(__name__)
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+T = TypeVar("T")
+
+OPENAI_BASE_URL: Optional[str] = os.getenv("OPENAI_BASE_URL")  # e.g. a local OpenAI compatible server
+MAX_CONCURRENT_REQUESTS = 8  # requests in flight at once from the async client
+MAX_KEEPALIVE_CONNECTIONS = 4  # idle connections kept open for reuse
+REQUEST_TIMEOUT = 10.0  # seconds per request
+MAX_RETRIES = 2  # extra attempts after a retryable error
+RETRY_BACKOFF = 0.5  # seconds before the first retry, doubled after each
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+_client: Optional[OpenAI] = None
+# Async clients and their semaphores bind to the loop they are first used in,
+# so each running event loop gets its own pair
+_async_clients: Dict[asyncio.AbstractEventLoop, Tuple[AsyncOpenAI, asyncio.Semaphore]] = {}
+
+# Replies are only cached for temperature 0, where the same request gives the same answer
+RESPONSE_CACHE = ResponseCache()
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        # Retries are done by _create so they show up in LLM_STATS
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL, max_retries=0)
+    return _client
+
+
+def get_async_client(
+    max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+    max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+) -> Tuple[AsyncOpenAI, asyncio.Semaphore]:
+    # One pooled keep-alive client shared by every request in the running
+    # event loop, created on first use in that loop. Callers own closing it:
+    # await close_async_client() before the loop ends, or use run_with_client.
+    loop = asyncio.get_running_loop()
+    for closed in [other for other in _async_clients if other.is_closed()]:
+        # Its connections belonged to the closed loop, nothing can close them now
+        del _async_clients[closed]
+        log.warning("Async client of a closed event loop was never closed, call close_async_client first")
+    if loop not in _async_clients:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_concurrent_requests,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=REQUEST_TIMEOUT,
+        )
+        client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL,
+            http_client=http_client,
+            max_retries=0,
+        )
+        _async_clients[loop] = (client, asyncio.Semaphore(max_concurrent_requests))
+    return _async_clients[loop]
+
+
+async def close_async_client() -> None:
+    # Closes the client of the running event loop
+    client, _ = _async_clients.pop(asyncio.get_running_loop(), (None, None))
+    if client is not None:
+        await client.close()
+
+
+def run_with_client(main: Awaitable[T]) -> T:
+    # asyncio.run that closes the loop's async client before the loop ends
+    async def _main() -> T:
+        try:
+            return await main
+        finally:
+            await close_async_client()
+    return asyncio.run(_main())
+
+
+def _create(call: LLMCall, request: Callable[[], Any], max_retries: int = MAX_RETRIES) -> Any:
+    # Retries with exponential backoff, each retry is counted on the call
+    for attempt in range(max_retries + 1):
+        try:
+            if attempt == 0:
+                call.sent()
+            return request()
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            call.retries += 1
+            log.warning(f"Retrying OpenAI request after {type(e).__name__}")
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+async def _create_async(
+    call: LLMCall,
+    request: Callable[[], Awaitable[Any]],
+    max_retries: int = MAX_RETRIES,
+) -> Any:
+    for attempt in range(max_retries + 1):
+        try:
+            if attempt == 0:
+                call.sent()
+            return await request()
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            call.retries += 1
+            log.warning(f"Retrying OpenAI request after {type(e).__name__}")
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
 
 def gpt_text(
     messages: List[Dict[str, str]] = None,
@@ -14,19 +126,115 @@ def gpt_text(
     temperature: float = 0,
     max_tokens: int = 32,
     stop: List[str] = ["\n"],
+    cache: Optional[ResponseCache] = RESPONSE_CACHE,
+    timeout: float = REQUEST_TIMEOUT,
+) -> str:
+    def _request() -> str:
+        log.debug(f"Sending messages to OpenAI: {messages}")
+        with LLM_STATS.call() as call:
+            response = _create(call, lambda: get_client().chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stop=stop,
+                timeout=timeout,
+            ))
+            call.usage(response.usage)
+        reply: str = response.choices[0].message.content
+        log.debug(f"Received reply from OpenAI: {reply}")
+        return reply
+
+    if cache is None or temperature != 0:
+        return _request()
+    key = cache_key(model, messages, temperature, max_tokens, stop)
+    return cache.get_or_compute(key, _request)
+
+
+async def gpt_text_async(
+    messages: List[Dict[str, str]] = None,
+    model="gpt-3.5-turbo",
+    temperature: float = 0,
+    max_tokens: int = 32,
+    stop: List[str] = ["\n"],
+    cache: Optional[ResponseCache] = RESPONSE_CACHE,
+    timeout: float = REQUEST_TIMEOUT,
 ) -> str:
-    log.debug(f"Sending messages to OpenAI: {messages}")
-    response = client.chat_completions.create(
-        messages=messages,
-        model=model,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        stop=stop,
-    )
-    reply: str = response.choices[0].message.content
-    log.debug(f"Received reply from OpenAI: {reply}")
-    return reply
+    # Same as gpt_text but awaits the reply instead of blocking the event loop
+    async def _request() -> str:
+        client, limit = get_async_client()
+        log.debug(f"Sending messages to OpenAI: {messages}")
+        with LLM_STATS.call() as call:
+            async with limit:
+                response = await _create_async(call, lambda: client.chat.completions.create(
+                    messages=messages,
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stop=stop,
+                    timeout=timeout,
+                ))
+            call.usage(response.usage)
+        reply: str = response.choices[0].message.content
+        log.debug(f"Received reply from OpenAI: {reply}")
+        return reply
+
+    if cache is None or temperature != 0:
+        return await _request()
+    key = cache_key(model, messages, temperature, max_tokens, stop)
+    return await cache.get_or_compute_async(key, _request)
+
+
+async def gpt_stream_async(
+    messages: List[Dict[str, str]] = None,
+    model="gpt-3.5-turbo",
+    temperature: float = 0,
+    max_tokens: int = 32,
+    stop: List[str] = ["\n"],
+    timeout: float = REQUEST_TIMEOUT,
+) -> AsyncIterator[str]:
+    # Yields reply text as it arrives. Closing the generator early (aclose or
+    # breaking out of async for) closes the response and cancels the rest.
+    # Only opening the stream is retried, once text has been yielded it cannot be taken back.
+    client, limit = get_async_client()
+    log.debug(f"Streaming messages to OpenAI: {messages}")
+    with LLM_STATS.call() as call:
+        async with limit:
+            stream = await _create_async(call, lambda: client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stop=stop,
+                timeout=timeout,
+                stream=True,
+                stream_options={"include_usage": True},
+            ))
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        call.first_token()
+                        yield chunk.choices[0].delta.content
+                    call.usage(chunk.usage)
+            finally:
+                await stream.close()
+
+
+async def test_gpt_async(num_requests: int = 16) -> None:
+    # Point OPENAI_BASE_URL at a local stand-in to run this offline
+    log.setLevel(logging.DEBUG)
+    start_time = time.monotonic()
+    replies = await asyncio.gather(*[
+        gpt_text_async(max_tokens=8, messages=[{"role": "user", "content": f"hello {i}"}], cache=None)
+        for i in range(num_requests)
+    ])
+    log.debug(f"{len(replies)} replies in {time.monotonic() - start_time:.3f} seconds")
+    log.debug(LLM_STATS.summary())
+    await close_async_client()
 
 
 if __name__ == "__main__":
-    print(gpt_text(max_tokens=8, messages=[{"role": "user", "content": "hello"}]))
\ No newline at end of file
+    print(gpt_text(max_tokens=8, messages=[{"role": "user", "content": "hello"}]))
+    print(gpt_text(max_tokens=8, messages=[{"role": "user", "content": "hello"}]))
+    print(f"Cache stats {RESPONSE_CACHE.stats()}")
+    asyncio.run(test_gpt_async())
@@ -0,0 +1,141 @@
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTENT_LOG_PATH = os.path.join(ROOT_DIR, ".cache", "intents.jsonl")
+NGRAM_RANGE = (2, 4)  # character n-gram lengths
+MIN_SIMILARITY = 0.3  # cosine similarity to the best label needed to answer locally
+MIN_MARGIN = 0.1  # lead over the second best label needed to answer locally
+
+Vector = Dict[str, float]
+
+
+def ngrams(text: str, ngram_range: Tuple[int, int] = NGRAM_RANGE) -> Counter:
+    # Padded per word so n-grams do not run across words
+    counts: Counter = Counter()
+    for word in text.lower().replace("_", " ").split():
+        word = f" {word} "
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            for i in range(len(word) - n + 1):
+                counts[word[i:i + n]] += 1
+    return counts
+
+
+def _normalize(vector: Vector) -> Vector:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else vector
+
+
+class IntentClassifier:
+    # TF-IDF over character n-grams with one centroid per label, a linear
+    # model small enough to score a command in well under a millisecond.
+    # Trained from label descriptions plus logged (command, label) pairs.
+
+    def __init__(
+        self,
+        descriptions: Dict[str, List[str]],
+        log_path: Optional[str] = INTENT_LOG_PATH,
+        min_similarity: float = MIN_SIMILARITY,
+        min_margin: float = MIN_MARGIN,
+    ):
+        self.descriptions = descriptions
+        self.log_path = log_path
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.examples: List[Tuple[str, str]] = []  # (text, label)
+        self.idf: Dict[str, float] = {}
+        self.centroids: Dict[str, Vector] = {}
+        self.local: int = 0  # commands answered locally
+        self.fallback: int = 0  # commands sent to the llm
+        for label, texts in descriptions.items():
+            for text in texts:
+                self.examples.append((text, label))
+        if log_path is not None and os.path.exists(log_path):
+            with open(log_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry["label"] in descriptions:
+                        self.examples.append((entry["text"], entry["label"]))
+        self.fit()
+
+    def fit(self) -> None:
+        grams = [ngrams(text) for text, _ in self.examples]
+        df: Counter = Counter()
+        for counts in grams:
+            df.update(counts.keys())
+        n = len(self.examples)
+        self.idf = {gram: math.log((1 + n) / (1 + count)) + 1 for gram, count in df.items()}
+        sums: Dict[str, Vector] = defaultdict(lambda: defaultdict(float))
+        for counts, (_, label) in zip(grams, self.examples):
+            for gram, value in self._vector(counts).items():
+                sums[label][gram] += value
+        self.centroids = {label: _normalize(vector) for label, vector in sums.items()}
+
+    def _vector(self, counts: Counter) -> Vector:
+        return _normalize({
+            gram: (1 + math.log(count)) * self.idf[gram]
+            for gram, count in counts.items()
+            if gram in self.idf
+        })
+
+    def scores(self, text: str) -> List[Tuple[str, float]]:
+        vector = self._vector(ngrams(text))
+        scores = [
+            (label, sum(value * centroid.get(gram, 0.0) for gram, value in vector.items()))
+            for label, centroid in self.centroids.items()
+        ]
+        return sorted(scores, key=lambda x: x[1], reverse=True)
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        # (label, margin) if confident, (None, margin) if the llm should decide
+        scores = self.scores(text)
+        best_label, best = scores[0]
+        margin = best - (scores[1][1] if len(scores) > 1 else 0.0)
+        if best >= self.min_similarity and margin >= self.min_margin:
+            self.local += 1
+            return best_label, margin
+        self.fallback += 1
+        return None, margin
+
+    def add_example(self, text: str, label: str) -> None:
+        # Appended to the training log and learned right away
+        self.examples.append((text, label))
+        if self.log_path is not None:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps({"text": text, "label": label, "timestamp": time.time()}) + "\n")
+        self.fit()
+
+
+def test_intent() -> None:
+    log.setLevel(logging.DEBUG)
+    descriptions = {
+        "home": ["home", "home position or look up"],
+        "forward": ["forward", "look ahead, facing forward"],
+        "face_down": ["face down", "looking down, facing forward"],
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = os.path.join(tmp_dir, "intents.jsonl")
+        classifier = IntentClassifier(descriptions, log_path=log_path)
+        assert classifier.predict("go to the home position")[0] == "home"
+        assert classifier.predict("look down at the floor")[0] == "face_down"
+        assert classifier.predict("purple elephant")[0] is None
+        classifier.add_example("what is on the floor", "face_down")
+        assert IntentClassifier(descriptions, log_path=log_path).predict("what's on the floor")[0] == "face_down"
+        start_time = time.perf_counter()
+        for _ in range(1000):
+            classifier.predict("check out what is ahead of you")
+        log.debug(f"predict took {(time.perf_counter() - start_time):.3f} ms per command")
+
+
+if __name__ == "__main__":
+    test_intent()
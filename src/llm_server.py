@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+from .intent import IntentClassifier
+from .prompt import count_tokens
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+HOST = "127.0.0.1"
+PORT = 8765
+LATENCY = 0.2  # median seconds before the first token
+LATENCY_SIGMA = 0.5  # spread of the lognormal latency, 0 for a fixed latency
+TOKEN_DELAY = 0.01  # seconds between streamed tokens
+ERROR_RATE = 0.0  # fraction of requests answered with a 500
+RATE_LIMIT_RATE = 0.0  # fraction of requests answered with a 429
+RETRY_AFTER = 1  # seconds suggested to rate limited clients
+
+Replier = Callable[[List[Dict[str, str]]], str]
+
+NUMBERED_LINE = re.compile(r"^\s*(\d+)\s*[.):]\s*(.+)$")
+TOKEN_PIECE = re.compile(r"[A-Za-z0-9]+|[^A-Za-z0-9]+")  # splits face_down like a tokenizer would
+
+
+@dataclass
+class ServerConfig:
+    latency: float = LATENCY
+    latency_sigma: float = LATENCY_SIGMA
+    token_delay: float = TOKEN_DELAY
+    error_rate: float = ERROR_RATE
+    rate_limit_rate: float = RATE_LIMIT_RATE
+    seed: Optional[int] = None
+
+    def sample_latency(self, rng: random.Random) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency
+        return rng.lognormvariate(0.0, self.latency_sigma) * self.latency
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    streamed: int = 0
+    errors: int = 0  # injected 500s
+    rate_limited: int = 0  # injected 429s
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+def echo_replier(messages: List[Dict[str, str]]) -> str:
+    return messages[-1]["content"]
+
+
+def classifier_replier(classifier: IntentClassifier) -> Replier:
+    # Best label for the command, or one numbered answer per numbered
+    # command when several arrive in one batched request
+    def reply(messages: List[Dict[str, str]]) -> str:
+        lines = messages[-1]["content"].splitlines()
+        numbered = [NUMBERED_LINE.match(line) for line in lines]
+        if len(lines) > 1 and all(numbered):
+            return "\n".join(
+                f"{match.group(1)}. {classifier.scores(match.group(2))[0][0]}" for match in numbered
+            )
+        return classifier.scores(messages[-1]["content"])[0][0]
+    return reply
+
+
+def _truncate(reply: str, stop: Optional[List[str]], max_tokens: Optional[int]) -> List[str]:
+    # Reply as streamed pieces, cut at the first stop sequence and max_tokens
+    for sequence in [stop] if isinstance(stop, str) else stop or []:
+        if sequence in reply:
+            reply = reply[:reply.index(sequence)]
+    pieces = TOKEN_PIECE.findall(reply)
+    return pieces[:max_tokens] if max_tokens else pieces
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients reuse connections
+
+    def log_message(self, format: str, *args) -> None:
+        log.debug(format % args)
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self) -> None:
+        server: "LLMServer" = self.server.llm
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        server.stats.count("requests")
+        with server.lock:
+            roll = server.rng.random()
+            latency = server.config.sample_latency(server.rng)
+        if roll < server.config.rate_limit_rate:
+            server.stats.count("rate_limited")
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"Retry-After": str(RETRY_AFTER)},
+            )
+            return
+        if roll < server.config.rate_limit_rate + server.config.error_rate:
+            server.stats.count("errors")
+            self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+        time.sleep(latency)
+        messages = request["messages"]
+        pieces = _truncate(server.replier(messages), request.get("stop"), request.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model", "stand-in")
+        usage = {
+            "prompt_tokens": sum(count_tokens(message["content"]) for message in messages),
+            "completion_tokens": len(pieces),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(pieces)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+        server.stats.count("streamed")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(**fields) -> None:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model}
+            self._send_chunk(f"data: {json.dumps({**chunk, **fields})}\n\n".encode())
+
+        def choice(delta: Dict, finish_reason: Optional[str] = None) -> List[Dict]:
+            return [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+
+        try:
+            event(choices=choice({"role": "assistant", "content": ""}))
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(server.config.token_delay)
+                event(choices=choice({"content": piece}))
+            event(choices=choice({}, "stop"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                event(choices=[], usage=usage)
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped reading early, as the streaming pose resolver does
+            self.close_connection = True
+
+
+class LLMServer:
+    # OpenAI compatible chat completions on a background thread. Point the
+    # clients at it with OPENAI_BASE_URL=<base_url> to run offline.
+
+    def __init__(
+        self,
+        replier: Replier = echo_replier,
+        config: Optional[ServerConfig] = None,
+        host: str = HOST,
+        port: int = PORT,
+    ):
+        self.replier = replier
+        self.config = config or ServerConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.stats = ServerStats()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.llm = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "LLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        log.info(f"Stand-in llm serving at {self.base_url}")
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "LLMServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def _post(url: str, body: Dict) -> urllib.request.Request:
+    return urllib.request.Request(
+        url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}, method="POST"
+    )
+
+
+async def bench_gpt_async(num_requests: int = 200, stream: bool = False) -> str:
+    # Drives src.gpt against whatever OPENAI_BASE_URL points at
+    from .gpt import close_async_client, gpt_stream_async, gpt_text_async
+    from .metrics import LLM_STATS
+
+    async def one(i: int) -> str:
+        messages = [{"role": "user", "content": f"look down {i}"}]
+        if stream:
+            return "".join([delta async for delta in gpt_stream_async(messages=messages)])
+        return await gpt_text_async(messages=messages, cache=None)
+
+    start_time = time.monotonic()
+    await asyncio.gather(*[one(i) for i in range(num_requests)], return_exceptions=True)
+    elapsed = time.monotonic() - start_time
+    await close_async_client()
+    return f"{num_requests} requests in {elapsed:.2f} s, {num_requests / elapsed:.0f} req/s\n" + LLM_STATS.summary()
+
+
+def test_llm_server() -> None:
+    log.setLevel(logging.DEBUG)
+    classifier = IntentClassifier(
+        {"home": ["home", "look up"], "face_down": ["face down", "look at the floor"]}, log_path=None
+    )
+    config = ServerConfig(latency=0.01, latency_sigma=0.0, token_delay=0.0, seed=0)
+    with LLMServer(classifier_replier(classifier), config, port=0) as server:
+        url = f"{server.base_url}/chat/completions"
+        with urllib.request.urlopen(_post(url, {"messages": [{"role": "user", "content": "look down"}]})) as response:
+            reply = json.loads(response.read())
+        assert reply["choices"][0]["message"]["content"] == "face_down", reply
+        assert reply["usage"]["completion_tokens"] == 3
+        batch = {"messages": [{"role": "user", "content": "1. go home\n2. what is on the floor"}], "stop": None}
+        with urllib.request.urlopen(_post(url, batch)) as response:
+            assert json.loads(response.read())["choices"][0]["message"]["content"] == "1. home\n2. face_down"
+        streamed = {"messages": [{"role": "user", "content": "look down"}], "stream": True}
+        with urllib.request.urlopen(_post(url, streamed)) as response:
+            events = [line[len(b"data: "):] for line in response.read().splitlines() if line.startswith(b"data: ")]
+        assert events[-1] == b"[DONE]"
+        deltas = [json.loads(e)["choices"][0]["delta"].get("content", "") for e in events[:-1]]
+        assert deltas[1:4] == ["face", "_", "down"], deltas
+        server.config.rate_limit_rate = 1.0
+        try:
+            urllib.request.urlopen(_post(url, streamed))
+            raise AssertionError("Expected a 429")
+        except urllib.error.HTTPError as e:
+            assert e.code == 429 and e.headers["Retry-After"] == str(RETRY_AFTER)
+        log.debug(f"Stand-in stats {server.stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI compatible stand-in for offline runs")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    parser.add_argument("--latency-sigma", type=float, default=LATENCY_SIGMA)
+    parser.add_argument("--token-delay", type=float, default=TOKEN_DELAY)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE)
+    parser.add_argument("--rate-limit-rate", type=float, default=RATE_LIMIT_RATE)
+    parser.add_argument("--poses", action="store_true", help="answer with the best matching robot pose")
+    parser.add_argument("--bench", type=int, default=0, help="send this many requests through src.gpt and exit")
+    parser.add_argument("--stream", action="store_true", help="benchmark the streaming path")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    replier = echo_replier
+    if args.poses:
+        from .servos import make_pose_classifier
+        replier = classifier_replier(make_pose_classifier(log_path=None))
+    config = ServerConfig(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    server = LLMServer(replier, config, args.host, args.port).start()
+    if args.bench:
+        # src.gpt reads these on import
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+        log.info(asyncio.run(bench_gpt_async(args.bench, args.stream)))
+        server.stop()
+    else:
+        log.info(f"export OPENAI_BASE_URL={server.base_url}")
+        try:
+            server._thread.join()
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,328 @@
+import asyncio
+import bisect
+import json
+import logging
+import math
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+LATENCY_BUCKETS: List[float] = [0.001 * 2 ** (i / 2) for i in range(24)]  # 1ms to ~2.9s
+RATE_WINDOW = 2.0  # seconds of frames used for fps and bandwidth
+DROP_TOLERANCE = 1.5  # frame intervals longer than this many periods count as drops
+SUMMARY_INTERVAL = 10.0  # seconds between logged summaries
+TOKEN_BUCKETS: List[float] = [2 ** i for i in range(14)]  # 1 to 8192 tokens
+
+
+class Histogram:
+    # Fixed buckets, so recording is a bisect and a counter increment
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last bucket is overflow
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        # Upper edge of the bucket holding the q-th percentile
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q / 100 * self.count)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+@dataclass
+class CameraStats:
+    camera: str  # name of the camera
+    nominal_fps: float  # frame rate the camera was asked for
+    frames: int = 0  # frames received
+    dropped: int = 0  # frames missing from the sequence
+    bytes: int = 0  # bytes received
+    latency: Histogram = field(default_factory=Histogram)  # capture to consumer, seconds
+    _window: Deque[Tuple[float, int]] = field(default_factory=deque, repr=False)
+    _last_seq: Optional[int] = field(default=None, repr=False)
+    _last_timestamp: Optional[float] = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def frame(self, timestamp: float, nbytes: int, seq: Optional[int] = None) -> None:
+        # With a driver sequence number gaps are exact, otherwise they are
+        # estimated from intervals much longer than the nominal period
+        with self._lock:
+            if seq is not None and self._last_seq is not None:
+                self.dropped += max(seq - self._last_seq - 1, 0)
+            elif seq is None and self._last_timestamp is not None:
+                periods = (timestamp - self._last_timestamp) * self.nominal_fps
+                if periods > DROP_TOLERANCE:
+                    self.dropped += round(periods) - 1
+            self._last_seq = seq
+            self._last_timestamp = timestamp
+            self.frames += 1
+            self.bytes += nbytes
+            self._window.append((timestamp, nbytes))
+            while self._window[0][0] < timestamp - RATE_WINDOW:
+                self._window.popleft()
+
+    def consumed(self, timestamp: float, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.latency.record(now - timestamp)
+
+    def _span(self) -> float:
+        if len(self._window) < 2:
+            return 0.0
+        return self._window[-1][0] - self._window[0][0]
+
+    @property
+    def fps(self) -> float:
+        span = self._span()
+        return (len(self._window) - 1) / span if span else 0.0
+
+    @property
+    def bandwidth(self) -> float:
+        # bytes per second over the rate window
+        span = self._span()
+        return sum(nbytes for _, nbytes in list(self._window)[1:]) / span if span else 0.0
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "camera": self.camera,
+                "fps": self.fps,
+                "frames": self.frames,
+                "dropped": self.dropped,
+                "bytes": self.bytes,
+                "bandwidth": self.bandwidth,
+                "latency": self.latency.to_dict(),
+            }
+
+    def summary(self) -> str:
+        d = self.to_dict()
+        return (
+            f"{d['camera']}: {d['fps']:.1f} fps, {d['dropped']}/{d['frames'] + d['dropped']} dropped, "
+            f"{d['bandwidth'] / 1e6:.2f} MB/s, latency p50 {d['latency']['p50'] * 1e3:.1f} ms "
+            f"p95 {d['latency']['p95'] * 1e3:.1f} ms\n"
+        )
+
+
+CAMERA_STATS: Dict[str, CameraStats] = {}
+
+
+def camera_stats(camera: str, nominal_fps: float = 30.0) -> CameraStats:
+    if camera not in CAMERA_STATS:
+        CAMERA_STATS[camera] = CameraStats(camera, nominal_fps)
+    return CAMERA_STATS[camera]
+
+
+def camera_summary() -> str:
+    return "".join(stats.summary() for stats in CAMERA_STATS.values())
+
+
+@dataclass
+class LLMCall:
+    # Timings of one request, filled in by the caller as it progresses
+    start: float = field(default_factory=time.monotonic)
+    queue: float = 0.0  # seconds until the request was sent
+    ttft: Optional[float] = None  # seconds until the first streamed token
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    retries: int = 0
+
+    def sent(self) -> None:
+        self.queue = time.monotonic() - self.start
+
+    def first_token(self) -> None:
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.start
+
+    def usage(self, usage: Any) -> None:
+        # usage block of an OpenAI response, absent from some servers
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens
+            self.completion_tokens = usage.completion_tokens
+
+
+@dataclass
+class LLMStats:
+    calls: int = 0  # requests that reached the network
+    retries: int = 0  # extra attempts after retryable failures
+    queue: Histogram = field(default_factory=Histogram)  # seconds waiting for a connection slot
+    ttft: Histogram = field(default_factory=Histogram)  # seconds to the first streamed token
+    latency: Histogram = field(default_factory=Histogram)  # seconds from call to full reply or error
+    prompt_tokens: Histogram = field(default_factory=lambda: Histogram(TOKEN_BUCKETS))
+    completion_tokens: Histogram = field(default_factory=lambda: Histogram(TOKEN_BUCKETS))
+    errors: Counter = field(default_factory=Counter)  # exception class name -> count
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(
+        self,
+        latency: float,
+        queue: float = 0.0,
+        ttft: Optional[float] = None,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+        retries: int = 0,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        with self._lock:
+            self.calls += 1
+            self.retries += retries
+            self.queue.record(queue)
+            self.latency.record(latency)
+            if ttft is not None:
+                self.ttft.record(ttft)
+            if prompt_tokens is not None:
+                self.prompt_tokens.record(prompt_tokens)
+            if completion_tokens is not None:
+                self.completion_tokens.record(completion_tokens)
+            if error is not None:
+                self.errors[type(error).__name__] += 1
+
+    @contextmanager
+    def call(self) -> Iterator[LLMCall]:
+        # Records the call on exit, with the exception class if it raised.
+        # A stream closed early by its consumer (GeneratorExit) or a request
+        # cancelled by its caller, e.g. a hedge that lost, is not an error.
+        call = LLMCall()
+        error: Optional[BaseException] = None
+        try:
+            yield call
+        except (GeneratorExit, asyncio.CancelledError):
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.record(
+                time.monotonic() - call.start,
+                queue=call.queue,
+                ttft=call.ttft,
+                prompt_tokens=call.prompt_tokens,
+                completion_tokens=call.completion_tokens,
+                retries=call.retries,
+                error=error,
+            )
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "queue": self.queue.to_dict(),
+                "ttft": self.ttft.to_dict(),
+                "latency": self.latency.to_dict(),
+                "prompt_tokens": self.prompt_tokens.to_dict(),
+                "completion_tokens": self.completion_tokens.to_dict(),
+            }
+
+    def summary(self) -> str:
+        d = self.to_dict()
+        if not d["calls"]:
+            return ""
+        return (
+            f"llm: {d['calls']} calls, {d['retries']} retries, errors {d['errors']}, "
+            f"queue p95 {d['queue']['p95'] * 1e3:.0f} ms, ttft p50 {d['ttft']['p50'] * 1e3:.0f} ms, "
+            f"latency p50 {d['latency']['p50'] * 1e3:.0f} ms p95 {d['latency']['p95'] * 1e3:.0f} ms, "
+            f"tokens mean {d['prompt_tokens']['mean']:.0f} prompt {d['completion_tokens']['mean']:.0f} completion\n"
+        )
+
+
+LLM_STATS = LLMStats()
+
+
+def dump_metrics(path: Optional[str] = None) -> str:
+    # Machine readable snapshot of every metric, written to path if given
+    dump = json.dumps({
+        "time": time.time(),
+        "cameras": {name: stats.to_dict() for name, stats in CAMERA_STATS.items()},
+        "llm": LLM_STATS.to_dict(),
+    })
+    if path is not None:
+        with open(path, "w") as f:
+            f.write(dump)
+    return dump
+
+
+async def log_metrics(
+    interval: float = SUMMARY_INTERVAL,
+    dump_path: Optional[str] = None,
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        msg = camera_summary() + LLM_STATS.summary()
+        if msg:
+            log.info(msg)
+        if dump_path is not None:
+            dump_metrics(dump_path)
+
+
+def test_metrics() -> None:
+    log.setLevel(logging.DEBUG)
+    stats = CameraStats("test", 30.0)
+    for i in range(60):
+        if i in (10, 11, 40):
+            continue
+        stats.frame(i / 30.0, 1000)
+        stats.consumed(i / 30.0, now=i / 30.0 + 0.02)
+    assert stats.dropped == 3, stats.dropped
+    assert abs(stats.fps - 30.0) < 2.0, stats.fps
+    seq_stats = CameraStats("seq", 30.0)
+    for seq in [0, 1, 2, 5, 6]:
+        seq_stats.frame(seq / 30.0, 1000, seq=seq)
+    assert seq_stats.dropped == 2
+    log.debug(stats.summary())
+    llm_stats = LLMStats()
+    llm_stats.record(0.4, queue=0.01, ttft=0.1, prompt_tokens=120, completion_tokens=3)
+    llm_stats.record(2.0, retries=1, error=TimeoutError())
+    assert llm_stats.errors["TimeoutError"] == 1 and llm_stats.retries == 1
+    try:
+        with llm_stats.call() as call:
+            call.sent()
+            raise ConnectionError
+    except ConnectionError:
+        pass
+    assert llm_stats.calls == 3 and llm_stats.errors["ConnectionError"] == 1
+    try:
+        with llm_stats.call():
+            raise asyncio.CancelledError
+    except asyncio.CancelledError:
+        pass
+    assert llm_stats.calls == 4 and sum(llm_stats.errors.values()) == 2
+    json.loads(dump_metrics())
+    log.debug(llm_stats.summary())
+
+
+if __name__ == "__main__":
+    test_metrics()
@@ -0,0 +1,121 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MOTION_STRIDE = 8  # keep every Nth pixel in both directions
+MOTION_GRID = (3, 4)  # (rows, cols) of regions the view is split into
+PIXEL_THRESHOLD = 25.0  # absolute luma difference for a pixel to count as changed
+REGION_THRESHOLD = 0.02  # fraction of changed pixels for a region to count as moving
+BACKGROUND_ALPHA = 0.05  # running background update rate per frame
+MOTION_HOLD = 0.5  # seconds the gate stays open after the last motion
+LUMA = (0.299, 0.587, 0.114)  # RGB weights, reversed for BGR frames
+
+
+@dataclass
+class Motion:
+    moving: bool  # True if the gate is open for this frame
+    fractions: np.ndarray  # changed pixel fraction per region, shape MOTION_GRID
+    score: float  # largest region fraction
+
+
+class MotionGate:
+
+    def __init__(
+        self,
+        stride: int = MOTION_STRIDE,
+        grid: Tuple[int, int] = MOTION_GRID,
+        pixel_threshold: float = PIXEL_THRESHOLD,
+        region_threshold: float = REGION_THRESHOLD,
+        alpha: float = BACKGROUND_ALPHA,
+        hold: float = MOTION_HOLD,
+        bgr: bool = False,
+    ):
+        self.stride = stride
+        self.grid = grid
+        self.pixel_threshold = pixel_threshold
+        self.region_threshold = region_threshold
+        self.alpha = alpha
+        self.hold = hold
+        self.luma = np.array(LUMA[::-1] if bgr else LUMA, np.float32)
+        self.last_motion: float = float("-inf")
+        self.frames: int = 0  # frames seen
+        self.passed: int = 0  # frames the gate let through
+        # Buffers are allocated on the first frame once the size is known
+        self._gray: Optional[np.ndarray] = None
+        self._background: Optional[np.ndarray] = None
+        self._diff: Optional[np.ndarray] = None
+        self._changed: Optional[np.ndarray] = None
+
+    def _small(self, image: np.ndarray) -> np.ndarray:
+        # Strided view cropped so the regions tile it exactly, no pixels are copied
+        rows, cols = self.grid
+        small = image[::self.stride, ::self.stride]
+        h = small.shape[0] - small.shape[0] % rows
+        w = small.shape[1] - small.shape[1] % cols
+        return small[:h, :w]
+
+    def update(self, image: np.ndarray, timestamp: Optional[float] = None) -> Motion:
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        small = self._small(image)
+        if self._gray is None:
+            shape = small.shape[:2]
+            self._gray = np.empty(shape, np.float32)
+            self._diff = np.empty(shape, np.float32)
+            self._changed = np.empty(shape, bool)
+        if small.ndim == 3:
+            np.dot(small, self.luma, out=self._gray)
+        else:
+            self._gray[...] = small
+        self.frames += 1
+        if self._background is None:
+            self._background = self._gray.copy()
+            return Motion(False, np.zeros(self.grid, np.float32), 0.0)
+        np.subtract(self._gray, self._background, out=self._diff)
+        np.abs(self._diff, out=self._diff)
+        np.greater(self._diff, self.pixel_threshold, out=self._changed)
+        rows, cols = self.grid
+        h, w = self._changed.shape
+        fractions = self._changed.reshape(rows, h // rows, cols, w // cols).mean(axis=(1, 3))
+        score = float(fractions.max())
+        # background += alpha * (gray - background), in place
+        np.subtract(self._gray, self._background, out=self._diff)
+        self._diff *= self.alpha
+        self._background += self._diff
+        if score >= self.region_threshold:
+            self.last_motion = timestamp
+        moving = timestamp - self.last_motion <= self.hold
+        if moving:
+            self.passed += 1
+        return Motion(moving, fractions, score)
+
+    @property
+    def pass_rate(self) -> float:
+        return self.passed / self.frames if self.frames else 0.0
+
+
+def test_motion() -> None:
+    log.setLevel(logging.DEBUG)
+    rng = np.random.default_rng(0)
+    room = rng.integers(0, 255, (480, 640, 3), np.uint8)
+    gate = MotionGate(hold=0.0)
+    for i in range(10):
+        assert not gate.update(room, timestamp=float(i)).moving
+    cat = room.copy()
+    cat[300:460, 500:640] = 255 - cat[300:460, 500:640]
+    motion = gate.update(cat, timestamp=10.0)
+    assert motion.moving and motion.fractions[-1, -1] > 0.5 and motion.fractions[0, 0] == 0
+    start_time = time.monotonic()
+    for i in range(100):
+        gate.update(room, timestamp=11.0 + i)
+    log.debug(f"Gate update took {(time.monotonic() - start_time) / 100 * 1e3:.3f} ms per frame")
+    log.debug(f"Gate passed {gate.pass_rate:.2%} of frames")
+
+
+if __name__ == "__main__":
+    test_motion()
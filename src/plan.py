@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .gpt import gpt_text
+from .prompt import PROMPTS, CompiledPrompt
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+Arg = Union[str, float, int]
+
+PLAN_DELIMITER = ";"
+ARGS_DELIMITER = ","
+ACTION_PATTERN = re.compile(r"^(\w+)\(([^)]*)\)$")
+LATE_WARNING = 0.05  # seconds a step may start after its deadline before it is logged
+MAX_SLEEP = 60.0  # seconds, longest single sleep a plan may ask for
+
+
+class PlanError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Action:
+    name: str  # name of action
+    func: Callable  # sync functions run in a thread, coroutine functions are awaited
+    desc: str  # description of action for llm use
+    resource: Optional[str] = None  # steps sharing a resource run in order, None for sleeps
+    num_args: Tuple[int, int] = (0, 0)  # (min, max) number of arguments
+    arg_range: Optional[Tuple[float, float]] = None  # numeric arguments must lie in this range
+
+
+DEFAULT_ACTIONS: Dict[str, Action] = {
+    "move": Action(
+        "move",
+        lambda *args: print(f"move({args})"),
+        "move the robot arm to a position",
+        resource="arm",
+        num_args=(3, 3),
+        arg_range=(0, 360),
+    ),
+    "sleep": Action(
+        "sleep",
+        None,  # never called, sleeps only push back the deadlines of later steps
+        "wait for a period of time",
+        num_args=(1, 1),
+        arg_range=(0, MAX_SLEEP),
+    ),
+    "take_image": Action(
+        "take_image",
+        lambda *args: print(f"take_image({args})"),
+        "take an image",
+        resource="camera",
+        num_args=(0, 1),
+    ),
+}
+
+PLAN_DATASET: Dict[str, str] = {
+    "halfway then back with one second sleeps" : PLAN_DELIMITER.join([
+        "move(0, 0, 0)",
+        "sleep(1.0)",
+        "move(180, 180, 180)",
+        "sleep(1.0)",
+        "move(0, 0, 0)",
+    ]),
+    "wait at the end" : PLAN_DELIMITER.join([
+        "move(360, 360, 360)",
+        "sleep(5.0)",
+    ]),
+    "wiggle" : PLAN_DELIMITER.join([
+        "move(90, 90, 90)",
+        "sleep(0.5)",
+        "move(45, 45, 45)",
+        "sleep(0.5)",
+        "move(90, 90, 90)",
+        "sleep(0.5)",
+        "move(135, 135, 135)",
+    ]),
+}
+
+
+@dataclass(frozen=True)
+class Step:
+    index: int  # position in the plan
+    action: str  # name of the action
+    args: Tuple[Arg, ...]
+    at: float  # seconds after the plan starts before this step may run
+    resource: Optional[str]
+
+    def __str__(self) -> str:
+        return f"{self.action}({', '.join(str(arg) for arg in self.args)})"
+
+
+@dataclass(frozen=True)
+class CompiledPlan:
+    # Validated, immutable list of steps, run as many times as needed
+    steps: Tuple[Step, ...]
+    duration: float  # seconds of sleeps, the time of the last deadline
+
+    def __str__(self) -> str:
+        return PLAN_DELIMITER.join(str(step) for step in self.steps)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+
+@dataclass
+class StepResult:
+    step: Step
+    deadline: float  # monotonic time the step was scheduled for
+    started: float
+    finished: float
+    result: Any = None
+
+    @property
+    def late(self) -> float:
+        return self.started - self.deadline
+
+
+def parse_arg(raw: str) -> Arg:
+    for cast in (int, float):
+        try:
+            return cast(raw)
+        except ValueError:
+            pass
+    return raw.strip("'\"")
+
+
+class PlanCompiler:
+    # Parses and validates each distinct plan string once
+
+    def __init__(self, actions: Dict[str, Action] = DEFAULT_ACTIONS):
+        self.actions = actions
+        self._plans: Dict[str, CompiledPlan] = {}
+
+    def compile(self, raw_str: str) -> CompiledPlan:
+        if raw_str not in self._plans:
+            self._plans[raw_str] = self._compile(raw_str)
+        return self._plans[raw_str]
+
+    def _compile(self, raw_str: str) -> CompiledPlan:
+        steps: List[Step] = []
+        at: float = 0.0
+        errors: List[str] = []
+        raw_actions = [raw.strip() for raw in raw_str.strip().split(PLAN_DELIMITER)]
+        for raw_action in filter(None, raw_actions):
+            match = ACTION_PATTERN.match(raw_action)
+            if match is None:
+                errors.append(f"Invalid action format: {raw_action}")
+                continue
+            name, raw_args = match.groups()
+            action = self.actions.get(name)
+            if action is None:
+                errors.append(f"Unknown action: {name}")
+                continue
+            args = tuple(parse_arg(arg.strip()) for arg in raw_args.split(ARGS_DELIMITER) if arg.strip())
+            error = self._validate(action, args)
+            if error is not None:
+                errors.append(f"{raw_action}: {error}")
+                continue
+            steps.append(Step(len(steps), name, args, at, action.resource))
+            if action.resource is None and args:
+                at += float(args[0])
+        if errors:
+            raise PlanError("; ".join(errors))
+        if not steps:
+            raise PlanError(f"Empty plan: {raw_str!r}")
+        return CompiledPlan(tuple(steps), at)
+
+    @staticmethod
+    def _validate(action: Action, args: Tuple[Arg, ...]) -> Optional[str]:
+        low, high = action.num_args
+        if not low <= len(args) <= high:
+            return f"expected {low} to {high} arguments, got {len(args)}"
+        if action.arg_range is not None:
+            for arg in args:
+                if not isinstance(arg, (int, float)):
+                    return f"argument {arg!r} is not a number"
+                if not math.isfinite(arg):
+                    return f"argument {arg} is not finite"
+                if not action.arg_range[0] <= arg <= action.arg_range[1]:
+                    return f"argument {arg} outside {action.arg_range}"
+        return None
+
+
+PLANS = PlanCompiler()
+
+
+async def _run_step(
+    step: Step,
+    action: Action,
+    deadline: float,
+    after: Optional[asyncio.Task],
+) -> StepResult:
+    loop = asyncio.get_running_loop()
+    # Absolute deadlines, so time spent in earlier steps never adds up as drift
+    delay = deadline - loop.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    if after is not None:
+        await after
+    started = loop.time()
+    if started - deadline > LATE_WARNING:
+        log.warning(f"Step {step.index} {step} started {started - deadline:.3f} seconds late")
+    if asyncio.iscoroutinefunction(action.func):
+        result = await action.func(*step.args)
+    else:
+        result = await asyncio.to_thread(action.func, *step.args)
+    return StepResult(step, deadline, started, loop.time(), result)
+
+
+async def execute(
+    plan: CompiledPlan,
+    actions: Dict[str, Action] = DEFAULT_ACTIONS,
+) -> List[StepResult]:
+    # Each step runs at plan start + step.at, once the previous step using
+    # the same resource is done, so a take_image overlaps the move before it.
+    # Returns no earlier than plan.duration after the start, so trailing
+    # sleeps are waited out. If a step fails the rest of the plan is cancelled.
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks: List[asyncio.Task] = []
+    last: Dict[str, asyncio.Task] = {}
+    for step in plan.steps:
+        if step.resource is None:
+            continue
+        task = asyncio.create_task(_run_step(step, actions[step.action], start + step.at, last.get(step.resource)))
+        last[step.resource] = task
+        tasks.append(task)
+    try:
+        results = list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    await asyncio.sleep(max(0, start + plan.duration - loop.time()))
+    return results
+
+
+def plan_prompt() -> CompiledPrompt:
+    # The system message and few shot examples are compiled once and reused
+    return PROMPTS.compile(
+        "plan",
+        [
+            "Output a robot motion plan based on a string description.",
+            "You output motion plans for a 3DoF robot arm.",
+            f"Motion plans are sequences of python function calls delimited by {PLAN_DELIMITER}.",
+        ],
+        examples=list(PLAN_DATASET.items()),
+        separator=" ",
+    )
+
+
+def plan_from_description(
+    description: str,
+) -> str:
+    prompt = plan_prompt()
+    log.debug(f"Prompt budget {prompt.budget(description)}")
+    return gpt_text(messages=prompt.messages(description))
+
+
+def test_plan() -> None:
+    log.setLevel(logging.DEBUG)
+    compiler = PlanCompiler()
+    for raw_str in PLAN_DATASET.values():
+        plan = compiler.compile(raw_str)
+        assert compiler.compile(raw_str) is plan
+        assert compiler.compile(str(plan)).steps == plan.steps
+    wiggle = compiler.compile(PLAN_DATASET["wiggle"])
+    # Repeated actions stay separate steps with their own arguments
+    assert [step.args for step in wiggle.steps if step.action == "move"] == [
+        (90, 90, 90), (45, 45, 45), (90, 90, 90), (135, 135, 135)
+    ]
+    for bad in [
+        "move(1, 2)", "fly(1)", "move(0, 0, 400)", "sleep(soon)", "move 1 2 3",
+        "move(0, 0, 0); sleep(inf)", "sleep(nan)", f"sleep({MAX_SLEEP + 1})",
+    ]:
+        try:
+            compiler.compile(bad)
+            raise AssertionError(f"Expected PlanError for {bad}")
+        except PlanError as e:
+            log.debug(f"Rejected {bad}: {e}")
+
+    calls: List[Tuple[str, float]] = []
+
+    def slow(name: str) -> Callable:
+        def func(*args) -> None:
+            calls.append((name, time.monotonic()))
+            time.sleep(0.05)
+        return func
+
+    actions = {
+        **DEFAULT_ACTIONS,
+        "move": Action("move", slow("move"), "", "arm", (3, 3), (0, 360)),
+        "take_image": Action("take_image", slow("take_image"), "", "camera", (0, 1)),
+    }
+    plan = PlanCompiler(actions).compile("move(0, 0, 0); take_image(); sleep(0.1); move(90, 90, 90); sleep(0.1); take_image()")
+    results = asyncio.run(execute(plan, actions))
+    assert [str(r.step) for r in results] == ["move(0, 0, 0)", "take_image()", "move(90, 90, 90)", "take_image()"]
+    # take_image overlaps the first move instead of waiting for it
+    assert results[1].started < results[0].finished
+    # Deadlines are absolute, so the last step starts 0.2 seconds in despite the 0.05 second moves
+    assert abs(results[3].deadline - results[0].deadline - 0.2) < 1e-9
+    assert all(r.late < LATE_WARNING for r in results), [r.late for r in results]
+    log.debug("".join(f"{r.step} started {r.late * 1e3:.1f} ms late\n" for r in results))
+    # A trailing sleep is waited out before the plan returns
+    plan = PlanCompiler(actions).compile("take_image(); sleep(0.2)")
+    start_time = time.monotonic()
+    asyncio.run(execute(plan, actions))
+    elapsed = time.monotonic() - start_time
+    assert plan.duration <= elapsed < plan.duration + LATE_WARNING, elapsed
+
+
+if __name__ == "__main__":
+    test_plan()
@@ -0,0 +1,197 @@
+import logging
+import math
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .intent import ngrams
+from .plan import PLAN_DATASET, PLANS, CompiledPlan, PlanCompiler, PlanError, plan_from_description
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLAN_LIBRARY_PATH = os.path.join(ROOT_DIR, ".cache", "plans.sqlite")
+MIN_SIMILARITY = 0.8  # cosine similarity needed to reuse a stored plan
+SEARCH_CANDIDATES = 5  # closest stored plans checked for matching numbers
+NUMBER_WORDS: Dict[str, float] = {
+    word: float(value) for value, word in enumerate(
+        ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]
+    )
+}
+NUMBER_PATTERN = re.compile(rf"\d+(?:\.\d+)?|\b(?:{'|'.join(NUMBER_WORDS)})\b")
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS plans (
+    description TEXT PRIMARY KEY,
+    plan TEXT NOT NULL,
+    created REAL NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+Vector = Dict[str, float]
+
+
+def normalize_description(description: str) -> str:
+    return " ".join(description.lower().split())
+
+
+def numeric_tokens(description: str) -> Tuple[float, ...]:
+    # Numbers in a description are plan arguments, "1", "1.0" and "one" are the same
+    return tuple(
+        NUMBER_WORDS[number] if number in NUMBER_WORDS else float(number)
+        for number in NUMBER_PATTERN.findall(description.lower())
+    )
+
+
+def _vector(description: str) -> Vector:
+    counts = ngrams(description)
+    vector = {gram: 1 + math.log(count) for gram, count in counts.items()}
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {gram: v / norm for gram, v in vector.items()} if norm else vector
+
+
+class PlanLibrary:
+    # Description -> plan store in sqlite with an in-memory inverted index
+    # over character n-grams, so near duplicate descriptions skip the llm
+
+    def __init__(
+        self,
+        path: str = PLAN_LIBRARY_PATH,
+        min_similarity: float = MIN_SIMILARITY,
+        compiler: PlanCompiler = PLANS,
+        seed: Optional[Dict[str, str]] = PLAN_DATASET,
+    ):
+        self.path = path
+        self.min_similarity = min_similarity
+        self.compiler = compiler
+        self.hits: int = 0
+        self.misses: int = 0
+        self._plans: Dict[str, str] = {}  # normalized description -> plan string
+        self._vectors: Dict[str, Vector] = {}
+        self._numbers: Dict[str, Tuple[float, ...]] = {}
+        self._index: Dict[str, Set[str]] = defaultdict(set)  # n-gram -> descriptions containing it
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        for description, plan in self.db.execute("SELECT description, plan FROM plans"):
+            self._remember(description, plan)
+        for description, plan in (seed or {}).items():
+            if normalize_description(description) not in self._plans:
+                self.add(description, plan)
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def _remember(self, description: str, plan: str) -> None:
+        self._plans[description] = plan
+        self._vectors[description] = _vector(description)
+        self._numbers[description] = numeric_tokens(description)
+        for gram in self._vectors[description]:
+            self._index[gram].add(description)
+
+    def add(self, description: str, plan: str) -> CompiledPlan:
+        # Only plans that compile are stored, PlanError is raised otherwise
+        compiled = self.compiler.compile(plan)
+        description = normalize_description(description)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO plans (description, plan, created) VALUES (?, ?, ?)",
+                (description, str(compiled), time.time()),
+            )
+        self._remember(description, str(compiled))
+        return compiled
+
+    def search(self, description: str, k: int = 1) -> List[Tuple[str, float]]:
+        # (description, cosine similarity) of the k closest stored plans
+        query = _vector(normalize_description(description))
+        scores: Dict[str, float] = defaultdict(float)
+        for gram, value in query.items():
+            for candidate in self._index.get(gram, ()):
+                scores[candidate] += value * self._vectors[candidate][gram]
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def lookup(self, description: str) -> Optional[Tuple[CompiledPlan, str, float]]:
+        # (plan, matched description, similarity) if a stored plan is close
+        # enough and mentions exactly the same numbers, n-grams barely see
+        # the difference between "wait 1 second" and "wait 10 seconds"
+        normalized = normalize_description(description)
+        if normalized in self._plans:
+            match, similarity = normalized, 1.0
+        else:
+            numbers = numeric_tokens(normalized)
+            for match, similarity in self.search(normalized, k=SEARCH_CANDIDATES):
+                if similarity < self.min_similarity:
+                    return None
+                if self._numbers[match] == numbers:
+                    break
+            else:
+                return None
+        with self.db:
+            self.db.execute("UPDATE plans SET uses = uses + 1 WHERE description = ?", (match,))
+        return self.compiler.compile(self._plans[match]), match, similarity
+
+    def get_or_generate(
+        self,
+        description: str,
+        generate: Callable[[str], str] = plan_from_description,
+    ) -> CompiledPlan:
+        found = self.lookup(description)
+        if found is not None:
+            self.hits += 1
+            plan, match, similarity = found
+            log.debug(f"Plan for {description!r} from library entry {match!r} ({similarity:.2f})")
+            return plan
+        self.misses += 1
+        raw_plan = generate(description)
+        try:
+            return self.add(description, raw_plan)
+        except PlanError as e:
+            log.warning(f"Generated plan for {description!r} is invalid and was not stored: {e}")
+            raise
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def test_plan_library() -> None:
+    log.setLevel(logging.DEBUG)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "plans.sqlite")
+        library = PlanLibrary(path, compiler=PlanCompiler())
+        assert len(library) == len(PLAN_DATASET)
+        generated: List[str] = []
+
+        def generate(description: str) -> str:
+            generated.append(description)
+            return "move(10, 20, 30); sleep(0.5); take_image()"
+
+        assert str(library.get_or_generate("Wiggle", generate)) == PLAN_DATASET["wiggle"]
+        assert library.get_or_generate("halfway then back with 1 second sleeps", generate) is not None
+        assert not generated, generated
+        plan = library.get_or_generate("spin around and take a photo", generate)
+        assert generated == ["spin around and take a photo"] and len(plan) == 3
+        library.close()
+        # New plans survive a restart
+        library = PlanLibrary(path, compiler=PlanCompiler())
+        assert library.get_or_generate("spin around and take a photo!", generate) is not None
+        assert len(generated) == 1 and library.hits == 1
+        # Descriptions that differ only in their numbers never share a plan
+        library.add("look at 90 degrees then wait 1 seconds", "move(90, 90, 90); sleep(1)")
+        assert library.lookup("look at 90 degrees then wait 1.0 seconds") is not None
+        assert library.lookup("look at 30 degrees then wait 5 seconds") is None
+        assert library.lookup("look at 180 degrees then wait 10 seconds") is None
+        start_time = time.perf_counter()
+        for _ in range(1000):
+            library.lookup("wiggle a little then wait at the end")
+        log.debug(f"lookup took {(time.perf_counter() - start_time):.3f} ms per description")
+        library.close()
+
+
+if __name__ == "__main__":
+    test_plan_library()
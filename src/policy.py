@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Optional
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DEADLINE = 3.0  # seconds before giving up on the llm and answering locally
+HEDGE_PERCENTILE = 95  # a duplicate request is sent once the first is slower than this
+HEDGE_DELAY = 1.0  # seconds to wait before hedging until enough latencies are known
+MIN_SAMPLES = 20  # latencies needed before the percentile is trusted
+LATENCY_WINDOW = 200  # recent latencies kept, so the threshold follows the server
+MAX_HEDGES = 1  # duplicate requests allowed per call
+
+
+@dataclass
+class PolicyStats:
+    requests: int = 0  # calls made through the policy
+    hedges: int = 0  # duplicate requests sent
+    hedge_wins: int = 0  # calls answered by a duplicate
+    failures: int = 0  # requests that raised
+    deadline_misses: int = 0  # calls answered by the fallback
+
+
+class RequestPolicy:
+    # Wraps an async request with hedging and a hard deadline. A cached
+    # gpt_text_async is safe to wrap, but its duplicate joins the in-flight
+    # call instead of sending a new one, so pass cache=None to get real
+    # hedges. The fallback gets the same keyword arguments and must answer
+    # without the network.
+
+    def __init__(
+        self,
+        request: Callable[..., Awaitable[str]],
+        fallback: Optional[Callable[..., str]] = None,
+        deadline: float = DEADLINE,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        hedge_delay: float = HEDGE_DELAY,
+        max_hedges: int = MAX_HEDGES,
+        window: int = LATENCY_WINDOW,
+    ):
+        self.request = request
+        self.fallback = fallback
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = hedge_delay
+        self.max_hedges = max_hedges
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.stats = PolicyStats()
+
+    @property
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < MIN_SAMPLES:
+            return self.default_hedge_delay
+        ordered = sorted(self.latencies)
+        return ordered[min(math.ceil(self.hedge_percentile / 100 * len(ordered)), len(ordered)) - 1]
+
+    async def __call__(self, **kwargs) -> str:
+        self.stats.requests += 1
+        start_time = time.monotonic()
+        deadline = start_time + self.deadline
+        tasks = [asyncio.ensure_future(self.request(**kwargs))]
+        pending = set(tasks)
+        try:
+            while time.monotonic() < deadline:
+                can_hedge = len(tasks) <= self.max_hedges
+                if pending:
+                    now = time.monotonic()
+                    timeout = deadline - now
+                    if can_hedge:
+                        timeout = min(timeout, max(start_time + self.hedge_delay * len(tasks) - now, 0))
+                    done, pending = await asyncio.wait(
+                        pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            self.latencies.append(time.monotonic() - start_time)
+                            if task is not tasks[0]:
+                                self.stats.hedge_wins += 1
+                            return task.result()
+                        self.stats.failures += 1
+                        log.warning(f"Request failed with exception {task.exception()!r}")
+                    if done and pending:
+                        continue
+                elif not can_hedge:
+                    break
+                if can_hedge and time.monotonic() < deadline:
+                    # Slower than usual or already failed, race a duplicate
+                    self.stats.hedges += 1
+                    hedge = asyncio.ensure_future(self.request(**kwargs))
+                    tasks.append(hedge)
+                    pending.add(hedge)
+        finally:
+            for task in tasks:
+                task.cancel()
+        # Deadline passed or every request failed, the slow call still
+        # counts toward the distribution so the hedge threshold adapts
+        self.latencies.append(time.monotonic() - start_time)
+        self.stats.deadline_misses += 1
+        if self.fallback is None:
+            raise asyncio.TimeoutError(f"No reply within {self.deadline} seconds")
+        reply = self.fallback(**kwargs)
+        log.warning(f"Answered with fallback {reply!r} after {time.monotonic() - start_time:.3f} seconds")
+        return reply
+
+
+async def test_policy(num_requests: int = 200) -> None:
+    # Stand-in server with a heavy latency tail: most replies take ~20ms,
+    # one in ten takes 300ms and one in fifty never arrives in time
+    log.setLevel(logging.DEBUG)
+
+    async def request(**kwargs) -> str:
+        roll = random.random()
+        if roll < 0.02:
+            await asyncio.sleep(10.0)
+        elif roll < 0.1:
+            await asyncio.sleep(0.3)
+        else:
+            await asyncio.sleep(random.uniform(0.015, 0.025))
+        return "home"
+
+    policy = RequestPolicy(request, fallback=lambda **kwargs: "fallback", deadline=0.5)
+    random.seed(0)
+    latencies = []
+    for _ in range(num_requests):
+        start_time = time.monotonic()
+        reply = await policy(messages=[])
+        latencies.append(time.monotonic() - start_time)
+        assert reply in ("home", "fallback")
+    latencies.sort()
+    assert latencies[-1] < 0.6, latencies[-1]
+    assert policy.stats.hedges > 0 and policy.stats.hedge_wins > 0
+
+    async def hung(**kwargs) -> str:
+        await asyncio.sleep(10.0)
+        return "home"
+
+    stalled = RequestPolicy(hung, fallback=lambda **kwargs: "fallback", deadline=0.1, hedge_delay=0.05)
+    assert await stalled(messages=[]) == "fallback"
+    assert stalled.stats.hedges == 1 and stalled.stats.deadline_misses == 1
+    log.debug(
+        f"{policy.stats}, hedge delay {policy.hedge_delay * 1e3:.0f} ms, "
+        f"p50 {latencies[len(latencies) // 2] * 1e3:.0f} ms p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(test_policy())
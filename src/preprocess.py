@@ -0,0 +1,98 @@
+import logging
+import time
+import tracemalloc
+from typing import Tuple, Union
+
+import cv2
+import numpy as np
+import torch
+
+from .frame import Frame
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+INPUT_SIZE = 224  # square model input in pixels
+IMAGENET_MEAN = (0.485, 0.456, 0.406)  # RGB
+IMAGENET_STD = (0.229, 0.224, 0.225)  # RGB
+PREPROCESS_BUCKETS = [0.0001 * 2 ** (i / 2) for i in range(20)]  # 0.1ms to ~70ms
+
+
+class ModelInput:
+    # Turns uint8 capture buffers into a normalized (1, 3, S, S) float tensor.
+    # The center crop is a view, the resize and channel split write into
+    # reused uint8 buffers and a per channel lookup table does the uint8 ->
+    # float and mean/std in a single pass straight into the tensor's memory.
+    # BGR -> RGB is just the order the planes are looked up in. The same
+    # tensor is returned every call.
+
+    def __init__(
+        self,
+        size: int = INPUT_SIZE,
+        mean: Tuple[float, float, float] = IMAGENET_MEAN,
+        std: Tuple[float, float, float] = IMAGENET_STD,
+        crop: bool = True,
+    ):
+        self.size = size
+        self.crop = crop
+        self.tensor = torch.empty((1, 3, size, size), dtype=torch.float32)
+        self.array = self.tensor.numpy()  # shares memory with the tensor
+        self._resized = np.empty((size, size, 3), np.uint8)
+        self._planes = [np.empty((size, size), np.uint8) for _ in range(3)]
+        values = np.arange(256, dtype=np.float32)[:, None] / 255.0
+        # lut[c][v] is the normalized value of uint8 v in RGB channel c
+        self._lut = np.ascontiguousarray(
+            ((values - np.array(mean, np.float32)) / np.array(std, np.float32)).T
+        )
+        self.timing = Histogram(PREPROCESS_BUCKETS)  # seconds per call
+
+    def _square(self, image: np.ndarray) -> np.ndarray:
+        if not self.crop:
+            return image
+        h, w = image.shape[:2]
+        side = min(h, w)
+        top, left = (h - side) // 2, (w - side) // 2
+        return image[top:top + side, left:left + side]
+
+    def __call__(self, image: Union[np.ndarray, Frame], order: str = "RGB") -> torch.Tensor:
+        start_time = time.perf_counter()
+        if isinstance(image, Frame):
+            image, order = image.pixels, image.order
+        if order not in ("RGB", "BGR"):
+            # e.g. YUYV from read_raw, which has two planes and would be misread
+            raise ValueError(f"Unsupported pixel order {order}, expected RGB or BGR")
+        src = self._square(image)
+        if src.shape[:2] == (self.size, self.size):
+            resized = src
+        else:
+            resized = cv2.resize(src, (self.size, self.size), dst=self._resized, interpolation=cv2.INTER_AREA)
+        cv2.split(resized, self._planes)
+        for c in range(3):
+            plane = self._planes[c if order == "RGB" else 2 - c]
+            cv2.LUT(plane, self._lut[c], dst=self.array[0, c])
+        self.timing.record(time.perf_counter() - start_time)
+        return self.tensor
+
+
+def bench_preprocess(
+    shape: Tuple[int, int, int] = (480, 640, 3),
+    iterations: int = 100,
+) -> str:
+    msg: str = ""
+    image = np.random.default_rng(0).integers(0, 255, shape, np.uint8)
+    preprocess = ModelInput()
+    preprocess(image)  # warm up
+    tracemalloc.start()
+    for _ in range(iterations):
+        preprocess(Frame(image, "BGR", "bench"))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    msg += f"Preprocess {shape} -> {tuple(preprocess.tensor.shape)}: "
+    msg += f"p50 {preprocess.timing.percentile(50) * 1e3:.2f} ms, mean {preprocess.timing.mean * 1e3:.2f} ms, "
+    msg += f"peak traced allocation {peak} bytes over {iterations} calls\n"
+    return msg
+
+
+if __name__ == "__main__":
+    print(bench_preprocess())
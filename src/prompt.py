@@ -0,0 +1,121 @@
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MAX_PROMPT_TOKENS = 1024  # budget per request, exceeding it is logged as a warning
+TOKENIZER_MODEL = "gpt-3.5-turbo"
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+except Exception:  # tiktoken missing, or its vocabulary could not be loaded
+    def count_tokens(text: str) -> int:
+        # Rough estimate, about 4 bytes of English per token
+        return math.ceil(len(text.encode()) / 4)
+
+
+@dataclass
+class CompiledPrompt:
+    name: str  # name of the prompt for reporting
+    prefix: List[Dict[str, str]]  # static messages, the same objects every request
+    tokens: int  # tokens in the static prefix
+    fragments: List[Tuple[str, int]] = field(default_factory=list)  # (fragment, tokens) of the system message
+    max_tokens: int = MAX_PROMPT_TOKENS
+
+    def messages(self, user: str) -> List[Dict[str, str]]:
+        # Only the user message is new, so the prefix is byte identical
+        # across requests and provider side prompt caching applies
+        return self.prefix + [{"role": "user", "content": user}]
+
+    def budget(self, user: str) -> Dict[str, int]:
+        user_tokens = count_tokens(user)
+        budget = {
+            "prefix": self.tokens,
+            "user": user_tokens,
+            "total": self.tokens + user_tokens,
+            "max": self.max_tokens,
+        }
+        if budget["total"] > self.max_tokens:
+            log.warning(f"Prompt {self.name} is over budget: {budget}")
+        return budget
+
+
+class PromptCompiler:
+    # Builds each prompt once and caches token counts per fragment
+
+    def __init__(
+        self,
+        count: Callable[[str], int] = count_tokens,
+        max_tokens: int = MAX_PROMPT_TOKENS,
+    ):
+        self.count = count
+        self.max_tokens = max_tokens
+        self._tokens: Dict[str, int] = {}
+        self._prompts: Dict[Tuple, CompiledPrompt] = {}
+
+    def tokens(self, fragment: str) -> int:
+        if fragment not in self._tokens:
+            self._tokens[fragment] = self.count(fragment)
+        return self._tokens[fragment]
+
+    def compile(
+        self,
+        name: str,
+        fragments: List[str],
+        examples: Optional[List[Tuple[str, str]]] = None,
+        separator: str = "\n",
+    ) -> CompiledPrompt:
+        # fragments are joined into the system message, examples become
+        # (user, assistant) few shot pairs after it
+        key = (name, tuple(fragments), tuple(examples or ()), separator)
+        if key not in self._prompts:
+            prefix = [{"role": "system", "content": separator.join(fragments)}]
+            for user, assistant in examples or []:
+                prefix.append({"role": "user", "content": user})
+                prefix.append({"role": "assistant", "content": assistant})
+            self._prompts[key] = CompiledPrompt(
+                name=name,
+                prefix=prefix,
+                tokens=sum(self.tokens(message["content"]) for message in prefix),
+                fragments=[(fragment, self.tokens(fragment)) for fragment in fragments],
+                max_tokens=self.max_tokens,
+            )
+            log.debug(f"Compiled prompt {name} with {self._prompts[key].tokens} prefix tokens")
+        return self._prompts[key]
+
+    def report(self) -> str:
+        msg: str = ""
+        for prompt in self._prompts.values():
+            msg += f"{prompt.name}: {prompt.tokens} prefix tokens ("
+            msg += ", ".join(f"{tokens}" for _, tokens in prompt.fragments)
+            msg += f" per fragment, {len(prompt.prefix)} messages)\n"
+        return msg
+
+
+PROMPTS = PromptCompiler()
+
+
+def test_prompt() -> None:
+    log.setLevel(logging.DEBUG)
+    compiler = PromptCompiler()
+    prompt = compiler.compile("move", ["You control a robot.", "Return a pose name."])
+    assert compiler.compile("move", ["You control a robot.", "Return a pose name."]) is prompt
+    a, b = prompt.messages("look up"), prompt.messages("look down")
+    assert a[0] is b[0] and a[-1]["content"] == "look up"
+    budget = prompt.budget("look up")
+    assert budget["total"] == budget["prefix"] + budget["user"]
+    few_shot = compiler.compile("plan", ["Output a plan."], examples=[("wiggle", "move(90, 90, 90)")])
+    assert [m["role"] for m in few_shot.messages("nod")] == ["system", "user", "assistant", "user"]
+    log.debug(compiler.report())
+
+
+if __name__ == "__main__":
+    test_prompt()
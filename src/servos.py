@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from .intent import IntentClassifier
+
+# Servo and pose tables, importable without the dynamixel sdk
+
+@dataclass
+class Servo:
+    id: int # dynamixel id for servo
+    name: str # name of servo for llm use
+    range: Tuple[int, int] # (min, max) position values for servos (0, 4095)
+    desc: str # description of servo for llm use
+
+SERVOS: List[Servo] = [
+    Servo(1, "roll", (1761, 2499), "rolls the neck left and right rotating the view, roll"),
+    Servo(2, "tilt", (979, 2223), "tilts the head up and down vertically, pitch"),
+    Servo(3, "pan", (988, 3007), "pans the head side to side horizontally, yaw")
+]
+
+@dataclass
+class Pose:
+    name: str # name of pose for llm use
+    angles: List[int] # list of int angles in degrees (0, 360)
+    desc: str # description of position for llm use
+
+POSES: Dict[str, Pose] = {
+    "home" : Pose("home", [180, 211, 180], "home position or look up"),
+    "forward" : Pose("forward", [180, 140, 180], "look ahead, facing forward"),
+    "tilt_left" : Pose("tilt_left", [215, 130, 151], "looking forward, head tilted right"),
+    "tilt_right" : Pose("tilt_right", [145, 130, 209], "looking forward, head tilted left"),
+    "face_down": Pose("face_down", [180, 94, 180], "looking down, facing forward")
+}
+
+# Convert servo units into degrees for readability
+# Max for units is 4095, which is 360 degrees
+DEGREE_TO_UNIT: float = 4095 / 360.0
+
+def degrees_to_units(degree: int) -> int:
+    return int(degree * DEGREE_TO_UNIT)
+
+def units_to_degrees(position: int) -> int:
+    return int(position / DEGREE_TO_UNIT)
+
+def make_pose_classifier(poses: Dict[str, Pose] = POSES, **kwargs) -> IntentClassifier:
+    return IntentClassifier({name: [name, pose.desc] for name, pose in poses.items()}, **kwargs)
@@ -0,0 +1,232 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .cam import CAMERAS, ROBOT_DATA_DIR, Camera
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+STEREO_CAMERA: Camera = next(camera for camera in CAMERAS if camera.name == "stereo")
+STEREO_CALIBRATION_PATH = os.path.join(ROBOT_DATA_DIR, "stereo_calibration.npz")
+DISPARITY_DOWNSCALE = 2  # disparity is computed on a pair this many times smaller
+NUM_DISPARITIES = 32  # must be divisible by 16, in downscaled pixels
+BLOCK_SIZE = 15  # odd, StereoBM matching window
+DISTANCE_ROI = 0.2  # fraction of the (downscaled) view around the center used for target distance
+
+
+def split_stereo(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Side-by-side frame into (left, right) halves, both are views into image
+    half = image.shape[1] // 2
+    return image[:, :half], image[:, half:]
+
+
+@dataclass
+class StereoCalibration:
+    left_matrix: np.ndarray  # 3x3 intrinsics of the left camera
+    left_dist: np.ndarray  # distortion coefficients of the left camera
+    right_matrix: np.ndarray  # 3x3 intrinsics of the right camera
+    right_dist: np.ndarray  # distortion coefficients of the right camera
+    rotation: np.ndarray  # 3x3 rotation from left to right camera
+    translation: np.ndarray  # 3x1 translation from left to right camera in meters
+    size: Tuple[int, int]  # (width, height) of a single half in pixels
+
+    @classmethod
+    def load(cls, path: str = STEREO_CALIBRATION_PATH) -> "StereoCalibration":
+        with np.load(path) as data:
+            return cls(
+                left_matrix=data["left_matrix"],
+                left_dist=data["left_dist"],
+                right_matrix=data["right_matrix"],
+                right_dist=data["right_dist"],
+                rotation=data["rotation"],
+                translation=data["translation"],
+                size=tuple(int(v) for v in data["size"]),
+            )
+
+    def save(self, path: str = STEREO_CALIBRATION_PATH) -> None:
+        np.savez(
+            path,
+            left_matrix=self.left_matrix,
+            left_dist=self.left_dist,
+            right_matrix=self.right_matrix,
+            right_dist=self.right_dist,
+            rotation=self.rotation,
+            translation=self.translation,
+            size=np.array(self.size),
+        )
+
+    @property
+    def baseline(self) -> float:
+        return float(np.linalg.norm(self.translation))
+
+
+class StereoRectifier:
+
+    def __init__(
+        self,
+        calibration: StereoCalibration,
+        downscale: int = DISPARITY_DOWNSCALE,
+    ):
+        self.calibration = calibration
+        self.downscale = downscale
+        width, height = calibration.size
+        self.size = (width // downscale, height // downscale)
+        r1, r2, p1, p2, _, _, _ = cv2.stereoRectify(
+            calibration.left_matrix,
+            calibration.left_dist,
+            calibration.right_matrix,
+            calibration.right_dist,
+            calibration.size,
+            calibration.rotation,
+            calibration.translation,
+            alpha=0,
+        )
+        # Scaling the projection matrices makes the remap sample the full
+        # resolution halves straight into the downscaled rectified output,
+        # so rectification and downscaling happen in a single pass.
+        p1[:2] /= downscale
+        p2[:2] /= downscale
+        self.focal_length = float(p1[0, 0])  # in downscaled pixels
+        # Fixed point maps are computed once here and are faster to remap with
+        self.left_maps = cv2.initUndistortRectifyMap(
+            calibration.left_matrix, calibration.left_dist, r1, p1, self.size, cv2.CV_16SC2
+        )
+        self.right_maps = cv2.initUndistortRectifyMap(
+            calibration.right_matrix, calibration.right_dist, r2, p2, self.size, cv2.CV_16SC2
+        )
+        self.left = np.empty((self.size[1], self.size[0]), np.uint8)
+        self.right = np.empty((self.size[1], self.size[0]), np.uint8)
+
+    def rectify(self, gray: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Output buffers are reused between calls, copy them to keep a result
+        left, right = split_stereo(gray)
+        cv2.remap(left, *self.left_maps, cv2.INTER_LINEAR, dst=self.left)
+        cv2.remap(right, *self.right_maps, cv2.INTER_LINEAR, dst=self.right)
+        return self.left, self.right
+
+
+@dataclass
+class Depth:
+    timestamp: float  # time.monotonic() of the frame the depth was computed from
+    distance: Optional[float]  # meters to the target in the center of the view, None if unknown
+    disparity: np.ndarray  # float32 disparity in downscaled pixels, <= 0 where invalid
+    compute_time: float  # seconds spent computing this result
+
+
+class DisparityWorker:
+
+    def __init__(
+        self,
+        rectifier: StereoRectifier,
+        num_disparities: int = NUM_DISPARITIES,
+        block_size: int = BLOCK_SIZE,
+        roi: float = DISTANCE_ROI,
+    ):
+        self.rectifier = rectifier
+        self.matcher = cv2.StereoBM_create(numDisparities=num_disparities, blockSize=block_size)
+        self.roi = roi
+        self.depth: Optional[Depth] = None  # most recent result
+        self.dropped: int = 0  # frames replaced before the worker got to them
+        self.error: Optional[Exception] = None  # exception from the most recent failed frame
+        self._frame: Optional[np.ndarray] = None
+        self._timestamp: float = 0.0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "DisparityWorker":
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="disparity", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, image: np.ndarray, timestamp: Optional[float] = None) -> None:
+        # Never blocks on the computation, only the latest frame is kept. The
+        # frame is held by reference, so it must not be overwritten until the
+        # next submit.
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = image
+            self._timestamp = time.monotonic() if timestamp is None else timestamp
+            self._condition.notify()
+
+    @property
+    def distance(self) -> Optional[float]:
+        depth = self.depth
+        return None if depth is None else depth.distance
+
+    def compute(self, image: np.ndarray, timestamp: float) -> Depth:
+        start_time = time.monotonic()
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        left, right = self.rectifier.rectify(gray)
+        # StereoBM returns fixed point disparities with 4 fractional bits
+        disparity = self.matcher.compute(left, right).astype(np.float32)
+        disparity *= 1.0 / 16.0
+        h, w = disparity.shape
+        dh, dw = int(h * self.roi / 2), int(w * self.roi / 2)
+        center = disparity[h // 2 - dh:h // 2 + dh + 1, w // 2 - dw:w // 2 + dw + 1]
+        valid = center[center > 0]
+        distance = None
+        if valid.size:
+            baseline = self.rectifier.calibration.baseline
+            distance = self.rectifier.focal_length * baseline / float(np.median(valid))
+        return Depth(timestamp, distance, disparity, time.monotonic() - start_time)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and self._frame is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                image, timestamp = self._frame, self._timestamp
+                self._frame = None
+            try:
+                self.depth = self.compute(image, timestamp)
+                self.error = None
+            except Exception as e:
+                self.error = e
+                log.warning(f"Disparity failed with exception {e}")
+
+
+def test_stereo(image_path: str, timeout: float = 5.0) -> None:
+    # image_path is a side by side still, e.g. a take_image capture from the store
+    log.setLevel(logging.DEBUG)
+    image = cv2.imread(image_path)
+    assert image is not None, f"Could not read {image_path}"
+    left, right = split_stereo(image)
+    assert np.shares_memory(left, image) and np.shares_memory(right, image)
+    log.debug(f"Split {image.shape} into {left.shape} and {right.shape}")
+    worker = DisparityWorker(StereoRectifier(StereoCalibration.load())).start()
+    worker.submit(image)
+    deadline = time.monotonic() + timeout
+    while worker.depth is None and worker.error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    if worker.error is not None:
+        raise worker.error
+    assert worker.depth is not None, f"No depth after {timeout} seconds"
+    log.debug(f"Distance {worker.distance} computed in {worker.depth.compute_time:.4f} seconds")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_path", help="side by side stereo still to test on")
+    test_stereo(parser.parse_args().image_path)
@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+STORE_DIR_NAME = "store"  # directory inside the data dir holding content addressed files
+INDEX_FILENAME = "index.sqlite"
+HASH_CHUNK = 1 << 20  # bytes hashed at a time when hashing files
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash TEXT NOT NULL REFERENCES artifacts(hash),
+    camera TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_camera_time ON captures (camera, timestamp);
+CREATE INDEX IF NOT EXISTS captures_event ON captures (event);
+"""
+
+
+@dataclass
+class Capture:
+    hash: str  # sha256 of the artifact contents
+    path: str  # where the artifact lives on disk
+    camera: str  # name of the camera that produced it
+    timestamp: float  # unix time of the capture
+    event: str  # what triggered the capture, e.g. "image", "video", "motion"
+    new: bool = False  # True if this capture wrote new bytes to disk
+    sent: bool = False  # True if the artifact has already been transferred
+
+
+class CaptureStore:
+
+    def __init__(self, data_dir: str):
+        self.dir_path = os.path.join(data_dir, STORE_DIR_NAME)
+        os.makedirs(self.dir_path, exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(self.dir_path, INDEX_FILENAME), check_same_thread=False
+        )
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def artifact_path(self, digest: str, ext: str) -> str:
+        # Fan out on the first two hex characters to keep directories small
+        return os.path.join(self.dir_path, digest[:2], f"{digest}{ext}")
+
+    def add_bytes(
+        self,
+        data: bytes,
+        camera: str,
+        event: str,
+        ext: str,
+        timestamp: Optional[float] = None,
+    ) -> Capture:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.artifact_path(digest, ext)
+        if not self._exists(digest):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return self._index(digest, path, len(data), camera, event, timestamp)
+
+    def add_file(
+        self,
+        src_path: str,
+        camera: str,
+        event: str,
+        timestamp: Optional[float] = None,
+    ) -> Capture:
+        # Moves src_path into the store, or deletes it if the bytes are already stored
+        hasher = hashlib.sha256()
+        with open(src_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        path = self.artifact_path(digest, os.path.splitext(src_path)[1])
+        size = os.path.getsize(src_path)
+        if self._exists(digest):
+            os.remove(src_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(src_path, path)
+        return self._index(digest, path, size, camera, event, timestamp)
+
+    def _exists(self, digest: str) -> bool:
+        return self.db.execute(
+            "SELECT 1 FROM artifacts WHERE hash = ?", (digest,)
+        ).fetchone() is not None
+
+    def _index(
+        self,
+        digest: str,
+        path: str,
+        size: int,
+        camera: str,
+        event: str,
+        timestamp: Optional[float],
+    ) -> Capture:
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.db:
+            new = self.db.execute(
+                "INSERT OR IGNORE INTO artifacts (hash, path, size) VALUES (?, ?, ?)",
+                (digest, path, size),
+            ).rowcount == 1
+            self.db.execute(
+                "INSERT INTO captures (hash, camera, timestamp, event) VALUES (?, ?, ?, ?)",
+                (digest, camera, timestamp, event),
+            )
+        sent = bool(self.db.execute(
+            "SELECT sent FROM artifacts WHERE hash = ?", (digest,)
+        ).fetchone()[0])
+        if not new:
+            log.debug(f"Skipped writing duplicate {digest} from {camera}")
+        return Capture(digest, path, camera, timestamp, event, new=new, sent=sent)
+
+    def mark_sent(self, paths: Iterable[str]) -> None:
+        with self.db:
+            self.db.executemany(
+                "UPDATE artifacts SET sent = 1 WHERE path = ?", [(path,) for path in paths]
+            )
+
+    def unsent(self) -> List[str]:
+        return [row[0] for row in self.db.execute("SELECT path FROM artifacts WHERE sent = 0")]
+
+    def query(
+        self,
+        camera: Optional[str] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        event: Optional[str] = None,
+    ) -> List[Capture]:
+        # All captures matching the filters in time order, served from the index
+        clauses, params = [], []
+        for clause, param in [
+            ("c.camera = ?", camera),
+            ("c.timestamp >= ?", start),
+            ("c.timestamp <= ?", end),
+            ("c.event = ?", event),
+        ]:
+            if param is not None:
+                clauses.append(clause)
+                params.append(param)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.db.execute(
+            "SELECT c.hash, a.path, c.camera, c.timestamp, c.event, a.sent "
+            "FROM captures c JOIN artifacts a ON a.hash = c.hash "
+            f"{where} ORDER BY c.timestamp",
+            params,
+        )
+        return [
+            Capture(digest, path, camera, timestamp, event, sent=bool(sent))
+            for digest, path, camera, timestamp, event, sent in rows
+        ]
+
+
+def test_store() -> None:
+    log.setLevel(logging.DEBUG)
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = CaptureStore(data_dir)
+        first = store.add_bytes(b"frame a", "stereo", "image", ".jpg", timestamp=1.0)
+        second = store.add_bytes(b"frame a", "stereo", "image", ".jpg", timestamp=2.0)
+        third = store.add_bytes(b"frame b", "mono", "image", ".jpg", timestamp=3.0)
+        assert first.new and not second.new and third.new
+        assert first.path == second.path
+        assert len(store.query(camera="stereo", start=0.5, end=2.5)) == 2
+        assert len(store.query(camera="mono")) == 1
+        store.mark_sent([first.path])
+        assert store.unsent() == [third.path]
+        assert store.add_bytes(b"frame a", "stereo", "image", ".jpg").sent
+        store.close()
+
+
+if __name__ == "__main__":
+    test_store()
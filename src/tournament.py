@@ -0,0 +1,198 @@
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .servos import SERVOS, units_to_degrees
+from .trajectory import Trajectory, TrajectoryLibrary
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Servo model, a velocity and acceleration limited position controller
+SIM_DT = 0.01  # seconds per simulation step
+MAX_VELOCITY = 180.0  # degrees per second
+MAX_ACCELERATION = 900.0  # degrees per second squared
+GAIN = 10.0  # 1/seconds, velocity commanded per degree of error
+SETTLE_TOLERANCE = 1.0  # degrees from the last keyframe that count as arrived
+MAX_SETTLE_TIME = 2.0  # seconds allowed after the last keyframe to arrive
+
+# Camera view, the head points the camera with tilt (pitch) and pan (yaw)
+TILT, PAN = 1, 2  # servo indices
+CAMERA_FOV = (60.0, 45.0)  # horizontal, vertical degrees
+COVERAGE_CELL = 5.0  # degrees per cell of the view grid
+
+JOINT_LIMITS = np.array([(units_to_degrees(low), units_to_degrees(high)) for low, high in (s.range for s in SERVOS)])
+JERK_SCALE = 1e5  # degrees/s^3 rms jerk that halves the smoothness score
+DURATION_SCALE = 5.0  # seconds that halve the duration score
+WEIGHTS: Dict[str, float] = {"smoothness": 1.0, "margin": 1.0, "duration": 0.5, "coverage": 2.0}
+CHUNK_SIZE = 64  # trajectories per task sent to a worker
+
+
+@dataclass
+class Score:
+    index: int  # position in the library
+    description: str
+    smoothness: float  # 0 to 1, from rms jerk of the simulated motion
+    margin: float  # -1 to 1, closest approach to a joint limit over half the joint range, negative past it
+    duration: float  # 0 to 1, from the time taken to reach the last keyframe
+    coverage: float  # 0 to 1, fraction of the reachable view seen by the camera
+    seconds: float  # simulated time to reach the last keyframe
+    total: float = 0.0
+
+    def __post_init__(self):
+        self.total = sum(weight * getattr(self, name) for name, weight in WEIGHTS.items())
+
+    @property
+    def feasible(self) -> bool:
+        # Never commanded past a joint limit
+        return self.margin >= 0
+
+
+def simulate(trajectory: Trajectory, start: Optional[np.ndarray] = None) -> np.ndarray:
+    # (steps, num_servos) positions in degrees, keyframe k is the target from k * dt
+    positions = np.asarray(trajectory.keyframes, np.float64)
+    position = positions[0].copy() if start is None else np.asarray(start, np.float64).copy()
+    velocity = np.zeros_like(position)
+    num_steps = int(round(trajectory.duration / SIM_DT)) + int(MAX_SETTLE_TIME / SIM_DT)
+    steps_per_keyframe = max(int(round(trajectory.dt / SIM_DT)), 1)
+    path = np.empty((num_steps, len(position)))
+    max_dv = MAX_ACCELERATION * SIM_DT
+    for step in range(num_steps):
+        target = positions[min(step // steps_per_keyframe, len(positions) - 1)]
+        desired = np.clip(GAIN * (target - position), -MAX_VELOCITY, MAX_VELOCITY)
+        velocity += np.clip(desired - velocity, -max_dv, max_dv)
+        position += velocity * SIM_DT
+        path[step] = position
+        if step >= (len(positions) - 1) * steps_per_keyframe and np.all(np.abs(target - position) < SETTLE_TOLERANCE):
+            return path[:step + 1]
+    return path
+
+
+def coverage(path: np.ndarray) -> float:
+    # Fraction of the pan x tilt range the camera frustum swept over
+    low, high = JOINT_LIMITS[[PAN, TILT], 0], JOINT_LIMITS[[PAN, TILT], 1]
+    half_fov = np.array(CAMERA_FOV) / 2
+    shape = np.ceil((high - low + 2 * half_fov) / COVERAGE_CELL).astype(int)
+    seen = np.zeros(shape, bool)
+    # One frustum per cell the view centre visits, consecutive samples mostly repeat
+    centres = np.unique(np.floor((path[:, [PAN, TILT]] - low + half_fov) / COVERAGE_CELL).astype(int), axis=0)
+    radius = np.ceil(half_fov / COVERAGE_CELL).astype(int)
+    # Both bounds are clamped, a centre past a joint limit would give a
+    # negative stop that wraps around and marks most of the grid
+    low_cells = np.clip(centres - radius, 0, shape)
+    high_cells = np.clip(centres + radius + 1, 0, shape)
+    for (x0, y0), (x1, y1) in zip(low_cells, high_cells):
+        seen[x0:x1, y0:y1] = True
+    return float(seen.mean())
+
+
+def score(trajectory: Trajectory, index: int = 0) -> Score:
+    path = simulate(trajectory)
+    seconds = len(path) * SIM_DT
+    if len(path) > 3:
+        jerk = np.diff(path, n=3, axis=0) / SIM_DT ** 3
+        rms_jerk = float(np.sqrt(np.mean(jerk ** 2)))
+    else:
+        rms_jerk = 0.0
+    half_range = (JOINT_LIMITS[:, 1] - JOINT_LIMITS[:, 0]) / 2
+    # Commanded keyframes count too, the servo may not get there before the next one
+    visited = np.concatenate([path, trajectory.keyframes])
+    margins = np.minimum(visited.min(axis=0) - JOINT_LIMITS[:, 0], JOINT_LIMITS[:, 1] - visited.max(axis=0))
+    return Score(
+        index=index,
+        description=trajectory.description,
+        smoothness=1 / (1 + rms_jerk / JERK_SCALE),
+        margin=float(np.clip(np.min(margins / half_range), -1, 1)),
+        duration=1 / (1 + seconds / DURATION_SCALE),
+        coverage=coverage(path),
+        seconds=seconds,
+    )
+
+
+def _score_chunk(path: str, indices: Sequence[int]) -> List[Score]:
+    # Workers map the library themselves, only indices and scores are pickled
+    library = TrajectoryLibrary(path)
+    return [score(library[i], i) for i in indices]
+
+
+def run_tournament(path: str, workers: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> List[Score]:
+    # Scores every trajectory in a library file, best first, with every
+    # trajectory that crosses a joint limit ranked below the feasible ones
+    count = len(TrajectoryLibrary(path))
+    chunks = [range(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+    scores: List[Score] = []
+    if workers == 1:
+        for chunk in chunks:
+            scores.extend(_score_chunk(path, chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk_scores in pool.map(_score_chunk, [path] * len(chunks), chunks):
+                scores.extend(chunk_scores)
+    return sorted(scores, key=lambda s: (s.feasible, s.total), reverse=True)
+
+
+def format_table(scores: List[Score], top: int = 10) -> str:
+    msg: str = f"{'rank':>4} {'index':>6} {'total':>6} {'smooth':>6} {'margin':>6} {'durat':>6} {'cover':>6} {'secs':>5}  description\n"
+    for rank, s in enumerate(scores[:top], 1):
+        msg += (
+            f"{rank:>4} {s.index:>6} {s.total:>6.3f} {s.smoothness:>6.3f} {s.margin:>6.3f} "
+            f"{s.duration:>6.3f} {s.coverage:>6.3f} {s.seconds:>5.2f}  {s.description}\n"
+        )
+    return msg
+
+
+def bench_tournament(path: str, max_workers: Optional[int] = None) -> str:
+    msg: str = ""
+    max_workers = max_workers or os.cpu_count()
+    base = None
+    workers = 1
+    while workers <= max_workers:
+        start_time = time.perf_counter()
+        run_tournament(path, workers)
+        elapsed = time.perf_counter() - start_time
+        base = base or elapsed
+        msg += f"{workers} workers: {elapsed:.2f} s, speedup {base / elapsed:.2f}x\n"
+        workers *= 2
+    return msg
+
+
+def test_tournament(num_trajectories: int = 256) -> None:
+    log.setLevel(logging.DEBUG)
+    # A slow sweep across the pan range should beat a jerky jump past the joint limits
+    sweep = Trajectory(
+        [[180, 150, 110], [180, 150, 160], [180, 150, 210], [180, 150, 250]], dt=1.0, description="sweep"
+    )
+    jump = Trajectory([[180, 150, 180], [360, 0, 0], [180, 150, 180]], dt=0.2, description="jump")
+    assert score(sweep).total > score(jump).total
+    assert score(jump).margin < 0 < score(sweep).margin
+    # Parking past a joint limit never sees more than parking inside the limits
+    inside = coverage(np.array([[180.0, 150.0, 180.0]] * 10))
+    for outside in ([180.0, 150.0, 0.0], [180.0, 0.0, 180.0], [180.0, 0.0, 0.0]):
+        assert coverage(np.array([outside] * 10)) <= inside, outside
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "library.trajl")
+        rng = np.random.default_rng(0)
+        candidates = [
+            Trajectory(
+                rng.integers(JOINT_LIMITS[:, 0], JOINT_LIMITS[:, 1] + 1, (rng.integers(2, 9), len(JOINT_LIMITS))),
+                dt=float(rng.choice([0.25, 0.5, 1.0])),
+                description=f"random {i}",
+            )
+            for i in range(num_trajectories)
+        ]
+        TrajectoryLibrary.write(path, [sweep, jump] + candidates)
+        scores = run_tournament(path)
+        assert len(scores) == num_trajectories + 2 and scores[-1].description == "jump"
+        assert [s.index for s in run_tournament(path, workers=1)] == [s.index for s in scores]
+        log.debug(format_table(scores))
+        log.debug(bench_tournament(path))
+
+
+if __name__ == "__main__":
+    test_tournament()
@@ -0,0 +1,315 @@
+import csv
+import logging
+import os
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from .prompt import PROMPTS, CompiledPrompt
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+NUM_SERVOS = 3
+KEYFRAME_DT = 0.5  # seconds between keyframes unless a trajectory says otherwise
+KEYFRAME_DELIMITER = ";"
+SERVO_DELIMITER = ","
+MIN_ANGLE, MAX_ANGLE = 0, 360  # degrees, fits int16
+DTYPE = np.dtype("<i2")
+
+# Single trajectory file: header, utf-8 description, padding to 8 bytes,
+# then num_keyframes * num_servos little endian int16 angles
+TRAJECTORY_MAGIC = b"PLTJ"
+TRAJECTORY_HEADER = struct.Struct("<4sHHIfI")  # magic, version, num_servos, num_keyframes, dt, description bytes
+# Library file: header, fixed size index, descriptions blob, then every
+# trajectory's angles back to back. Entries are found by offset, nothing is parsed.
+LIBRARY_MAGIC = b"PLTL"
+LIBRARY_HEADER = struct.Struct("<4sHHIQQ")  # magic, version, num_servos, count, descriptions offset, data offset
+LIBRARY_INDEX = np.dtype([
+    ("offset", "<u8"),  # byte offset of the angles from the data offset
+    ("num_keyframes", "<u4"),
+    ("dt", "<f4"),
+    ("description_offset", "<u4"),  # from the descriptions offset
+    ("description_size", "<u4"),
+])
+VERSION = 1
+
+
+def _pad(size: int, alignment: int = 8) -> int:
+    return -size % alignment
+
+
+@dataclass
+class Trajectory:
+    keyframes: np.ndarray  # (num_keyframes, num_servos) int16 angles in degrees
+    dt: float = KEYFRAME_DT  # seconds between keyframes
+    description: str = ""
+
+    def __post_init__(self):
+        self.keyframes = np.asarray(self.keyframes, dtype=DTYPE)
+        if self.keyframes.ndim != 2:
+            raise ValueError(f"Keyframes must be (num_keyframes, num_servos), got {self.keyframes.shape}")
+        if self.keyframes.size and (self.keyframes.min() < MIN_ANGLE or self.keyframes.max() > MAX_ANGLE):
+            raise ValueError(f"Angles must be between {MIN_ANGLE} and {MAX_ANGLE}")
+
+    @property
+    def num_keyframes(self) -> int:
+        return self.keyframes.shape[0]
+
+    @property
+    def num_servos(self) -> int:
+        return self.keyframes.shape[1]
+
+    @property
+    def duration(self) -> float:
+        return max(self.num_keyframes - 1, 0) * self.dt
+
+    def __len__(self) -> int:
+        return self.num_keyframes
+
+    def __str__(self) -> str:
+        # Compact text form used in llm prompts, e.g. 0,0,0;360,360,360
+        return KEYFRAME_DELIMITER.join(
+            SERVO_DELIMITER.join(map(str, keyframe)) for keyframe in self.keyframes.tolist()
+        )
+
+    @classmethod
+    def parse(
+        cls,
+        trajectory_string: str,
+        num_servos: int = NUM_SERVOS,
+        **kwargs,
+    ) -> "Trajectory":
+        # Trailing delimiters, as the old __str__ wrote them, are ignored
+        keyframes = trajectory_string.strip().split(KEYFRAME_DELIMITER)
+        if not keyframes[-1].strip():
+            keyframes.pop()
+        rows: List[List[int]] = []
+        for i, keyframe in enumerate(keyframes):
+            values = keyframe.split(SERVO_DELIMITER)
+            if not values[-1].strip():
+                values.pop()
+            if len(values) != num_servos:
+                raise ValueError(f"Keyframe {i} has {len(values)} values, expected {num_servos}")
+            rows.append([int(value) for value in values])
+        return cls(np.array(rows, dtype=DTYPE).reshape(-1, num_servos), **kwargs)
+
+    def to_csv(self, path: str) -> None:
+        # time column in seconds, one column per servo, description as a comment line
+        with open(path, "w", newline="") as f:
+            if self.description:
+                f.write(f"# {self.description}\n")
+            writer = csv.writer(f)
+            writer.writerow(["time"] + [f"servo_{i}" for i in range(self.num_servos)])
+            for i, keyframe in enumerate(self.keyframes.tolist()):
+                writer.writerow([round(i * self.dt, 6)] + keyframe)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "Trajectory":
+        with open(path, newline="") as f:
+            first = f.readline()
+            description = first[1:].strip() if first.startswith("#") else ""
+            if not first.startswith("#"):
+                f.seek(0)
+            rows = list(csv.reader(f))[1:]
+        table = np.array(rows, dtype=np.float64).reshape(len(rows), -1)
+        dt = float(table[1, 0] - table[0, 0]) if len(table) > 1 else KEYFRAME_DT
+        return cls(np.rint(table[:, 1:]).astype(DTYPE), dt, description)
+
+    def save(self, path: str) -> None:
+        description = self.description.encode()
+        header = TRAJECTORY_HEADER.pack(
+            TRAJECTORY_MAGIC, VERSION, self.num_servos, self.num_keyframes, self.dt, len(description)
+        )
+        with open(path, "wb") as f:
+            f.write(header + description + b"\0" * _pad(len(header) + len(description)))
+            f.write(np.ascontiguousarray(self.keyframes).tobytes())
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "Trajectory":
+        with open(path, "rb") as f:
+            header = f.read(TRAJECTORY_HEADER.size)
+            magic, version, num_servos, num_keyframes, dt, description_size = TRAJECTORY_HEADER.unpack(header)
+            if magic != TRAJECTORY_MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} trajectory file")
+            description = f.read(description_size).decode()
+        offset = TRAJECTORY_HEADER.size + description_size
+        offset += _pad(offset)
+        shape = (num_keyframes, num_servos)
+        if mmap:
+            keyframes = np.memmap(path, DTYPE, "r", offset, shape)
+        else:
+            keyframes = np.fromfile(path, DTYPE, num_keyframes * num_servos, offset=offset).reshape(shape)
+        return cls(keyframes, dt, description)
+
+
+class TrajectoryLibrary:
+    # Read only view of a library file. Opening reads the fixed size header
+    # and maps the rest, indexing returns a Trajectory whose keyframes are a
+    # view into the mapped file, so both cost the same for any library size.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._map = np.memmap(path, np.uint8, "r")
+        magic, version, num_servos, count, descriptions_offset, data_offset = LIBRARY_HEADER.unpack_from(self._map)
+        if magic != LIBRARY_MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} trajectory library")
+        self.num_servos = num_servos
+        self.index = np.frombuffer(self._map, LIBRARY_INDEX, count, LIBRARY_HEADER.size)
+        self._descriptions = self._map[descriptions_offset:data_offset]
+        self._data_offset = data_offset
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> Trajectory:
+        entry = self.index[i]
+        start = self._data_offset + int(entry["offset"])
+        size = int(entry["num_keyframes"]) * self.num_servos * DTYPE.itemsize
+        keyframes = self._map[start:start + size].view(DTYPE).reshape(-1, self.num_servos)
+        return Trajectory(keyframes, float(entry["dt"]), self.description(i))
+
+    def __iter__(self) -> Iterator[Trajectory]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def description(self, i: int) -> str:
+        entry = self.index[i]
+        start = int(entry["description_offset"])
+        return self._descriptions[start:start + int(entry["description_size"])].tobytes().decode()
+
+    @staticmethod
+    def write(path: str, trajectories: Sequence[Trajectory]) -> None:
+        num_servos = trajectories[0].num_servos if trajectories else NUM_SERVOS
+        index = np.zeros(len(trajectories), LIBRARY_INDEX)
+        descriptions: List[bytes] = []
+        data_size = description_size = 0
+        for i, trajectory in enumerate(trajectories):
+            if trajectory.num_servos != num_servos:
+                raise ValueError(f"Trajectory {i} has {trajectory.num_servos} servos, expected {num_servos}")
+            description = trajectory.description.encode()
+            index[i] = (data_size, trajectory.num_keyframes, trajectory.dt, description_size, len(description))
+            descriptions.append(description)
+            data_size += trajectory.keyframes.nbytes
+            description_size += len(description)
+        descriptions_offset = LIBRARY_HEADER.size + index.nbytes
+        data_offset = descriptions_offset + description_size
+        data_offset += _pad(data_offset)
+        with open(path, "wb") as f:
+            f.write(LIBRARY_HEADER.pack(
+                LIBRARY_MAGIC, VERSION, num_servos, len(trajectories), descriptions_offset, data_offset
+            ))
+            f.write(index.tobytes())
+            f.write(b"".join(descriptions))
+            f.write(b"\0" * (data_offset - descriptions_offset - description_size))
+            for trajectory in trajectories:
+                f.write(np.ascontiguousarray(trajectory.keyframes).tobytes())
+
+
+def trajectory_prompt(
+    num_servos: int = NUM_SERVOS,
+    min_value: int = MIN_ANGLE,
+    max_value: int = MAX_ANGLE,
+) -> CompiledPrompt:
+    low = SERVO_DELIMITER.join([str(min_value)] * num_servos)
+    high = SERVO_DELIMITER.join([str(max_value)] * num_servos)
+    half = SERVO_DELIMITER.join([str(max_value // 2)] * num_servos)
+    return PROMPTS.compile(
+        "trajectory",
+        [
+            "Output a trajectory based on a string description of a trajectory and a number of keyframes.",
+            f"You output trajectories for a {num_servos}DoF robot arm.",
+            "A trajectory is a sequence of keyframes.",
+            f"Each keyframe represents {num_servos} integer degree values for each servo between {min_value} and {max_value}.",
+            f"The delimiter used for the trajectory is {KEYFRAME_DELIMITER}",
+            f"The delimiter used for the servo values is {SERVO_DELIMITER}",
+        ],
+        examples=[
+            ("keyframes: 3, description: min, max, min", KEYFRAME_DELIMITER.join([low, high, low])),
+            ("keyframes: 2, description: zero to halfway", KEYFRAME_DELIMITER.join([low, half])),
+        ],
+        separator=" ",
+    )
+
+
+def gpt_trajectory(
+    trajectory_description: str,
+    num_keyframes: int = 4,
+    num_servos: int = NUM_SERVOS,
+) -> Trajectory:
+    # Imported here so reading and scoring trajectories does not need the llm client
+    from .gpt import gpt_text
+
+    prompt = trajectory_prompt(num_servos)
+    reply = gpt_text(
+        messages=prompt.messages(f"keyframes: {num_keyframes}, description: {trajectory_description}"),
+        max_tokens=num_keyframes * num_servos * 4,
+    )
+    return Trajectory.parse(reply, num_servos, description=trajectory_description)
+
+
+def random_trajectories(
+    count: int,
+    num_keyframes: int = 8,
+    num_servos: int = NUM_SERVOS,
+    seed: Optional[int] = 0,
+) -> List[Trajectory]:
+    rng = np.random.default_rng(seed)
+    return [
+        Trajectory(
+            rng.integers(MIN_ANGLE, MAX_ANGLE + 1, (rng.integers(2, num_keyframes + 1), num_servos)),
+            description=f"random {i}",
+        )
+        for i in range(count)
+    ]
+
+
+def test_trajectory(library_size: int = 10000) -> None:
+    log.setLevel(logging.DEBUG)
+    trajectory = Trajectory.parse("0,0,0;360,360,360;180,90,45", description="min, max, middle")
+    assert str(trajectory) == "0,0,0;360,360,360;180,90,45"
+    assert str(Trajectory.parse("0,0,0,;360,360,360,;")) == "0,0,0;360,360,360"  # old __str__ output
+    for bad in ["0,0;0,0,0,0", "0,0,0;;0,0,0", "0,0,0,0"]:
+        try:
+            Trajectory.parse(bad)
+            raise AssertionError(f"Expected ValueError for {bad}")
+        except ValueError as e:
+            log.debug(f"Rejected {bad}: {e}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "t.csv")
+        trajectory.to_csv(csv_path)
+        from_csv = Trajectory.from_csv(csv_path)
+        assert np.array_equal(from_csv.keyframes, trajectory.keyframes)
+        assert from_csv.dt == trajectory.dt and from_csv.description == trajectory.description
+        binary_path = os.path.join(tmp_dir, "t.traj")
+        trajectory.save(binary_path)
+        loaded = Trajectory.load(binary_path)
+        assert np.array_equal(loaded.keyframes, trajectory.keyframes) and loaded.description == trajectory.description
+        trajectories = random_trajectories(library_size)
+        library_path = os.path.join(tmp_dir, "library.trajl")
+        start_time = time.perf_counter()
+        TrajectoryLibrary.write(library_path, trajectories)
+        write_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        library = TrajectoryLibrary(library_path)
+        open_time = time.perf_counter() - start_time
+        assert len(library) == library_size
+        for i in (0, library_size // 2, library_size - 1):
+            assert np.array_equal(library[i].keyframes, trajectories[i].keyframes)
+            assert library[i].description == trajectories[i].description
+        start_time = time.perf_counter()
+        for i in range(1000):
+            library[i * 7 % library_size]
+        get_time = (time.perf_counter() - start_time) / 1000
+        log.debug(
+            f"{library_size} trajectories, {os.path.getsize(library_path) / 1e3:.0f} KB: write {write_time * 1e3:.1f} ms, "
+            f"open {open_time * 1e3:.2f} ms, get {get_time * 1e6:.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    test_trajectory()
@@ -0,0 +1,238 @@
+import abc
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from .batch import next_batch
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+BATCH_SIZE = 16  # max files sent in one transport call
+BATCH_WINDOW = 0.2  # seconds to wait for more files before sending a batch
+MAX_RETRIES = 3  # attempts per batch before the files are dropped
+RETRY_BACKOFF = 1.0  # seconds, doubled after each failed attempt
+PARTIAL_SUFFIX = ".part"  # suffix of files that are still being written on the receiving end
+
+
+class TransferError(Exception):
+    pass
+
+
+class Transport(abc.ABC):
+    # Moves batches of local files to a destination directory. Subclasses keep
+    # whatever connection they need open between open() and close().
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def send(self, paths: List[str]) -> None:
+        ...
+
+
+class SSHTransport(Transport):
+    # One multiplexed ssh master connection is opened and every batch runs
+    # rsync through it, so the handshake is paid once. rsync sends all files
+    # of a batch in one session and keeps partial uploads as the basis for
+    # the retry. Captures are overwritten in place with the same name, so
+    # files are compared by size and mtime rather than appended to.
+
+    def __init__(
+        self,
+        username: str,
+        remote_ip: str,
+        remote_dir_path: str,
+        compress: bool = False,
+        control_path: Optional[str] = None,
+    ):
+        self.username = username
+        self.remote_ip = remote_ip
+        self.remote_dir_path = remote_dir_path
+        self.compress = compress
+        self.control_path = control_path or os.path.join(
+            tempfile.gettempdir(), f"plai-ssh-{username}@{remote_ip}"
+        )
+
+    @property
+    def host(self) -> str:
+        return f"{self.username}@{self.remote_ip}"
+
+    async def _run(self, cmd: List[str]) -> None:
+        log.debug(f"Running command: {cmd}")
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise TransferError(stderr.decode())
+
+    async def open(self) -> None:
+        await self._run([
+            "ssh", "-fN",
+            "-o", "ControlMaster=yes",
+            "-o", "ControlPersist=yes",
+            "-S", self.control_path,
+            self.host,
+        ])
+
+    async def close(self) -> None:
+        try:
+            await self._run(["ssh", "-S", self.control_path, "-O", "exit", self.host])
+        except TransferError as e:
+            log.debug(f"Closing ssh master failed: {e}")
+
+    async def send(self, paths: List[str]) -> None:
+        await self._run([
+            "rsync",
+            "--partial",
+            *(["--compress"] if self.compress else []),
+            "-e", f"ssh -S {self.control_path}",
+            *paths,
+            f"{self.host}:{self.remote_dir_path}",
+        ])
+
+
+class LocalTransport(Transport):
+    # Copies into a local directory, stands in for the remote host in tests.
+    # Files are written to a partial file first and resumed from its size.
+
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+
+    async def open(self) -> None:
+        os.makedirs(self.dir_path, exist_ok=True)
+
+    async def send(self, paths: List[str]) -> None:
+        await asyncio.to_thread(self._send, paths)
+
+    def _send(self, paths: List[str]) -> None:
+        for path in paths:
+            dest_path = os.path.join(self.dir_path, os.path.basename(path))
+            partial_path = dest_path + PARTIAL_SUFFIX
+            offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            with open(path, "rb") as src, open(partial_path, "ab") as dest:
+                src.seek(offset)
+                shutil.copyfileobj(src, dest)
+            os.replace(partial_path, dest_path)
+
+
+@dataclass
+class TransferStats:
+    files: int = 0  # files delivered
+    bytes: int = 0  # bytes delivered
+    batches: int = 0  # transport calls that succeeded
+    failures: int = 0  # transport calls that raised
+    dropped: int = 0  # files given up on after MAX_RETRIES
+
+
+class TransferQueue:
+
+    def __init__(
+        self,
+        transport: Transport,
+        batch_size: int = BATCH_SIZE,
+        batch_window: float = BATCH_WINDOW,
+        max_retries: int = MAX_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF,
+        on_sent: Optional[Callable[[List[str]], None]] = None,
+    ):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.on_sent = on_sent  # called with the paths of every delivered batch
+        self.stats = TransferStats()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> "TransferQueue":
+        await self.transport.open()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        # Sends everything already queued before closing the connection
+        await self._queue.join()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.transport.close()
+
+    def enqueue(self, path: str) -> None:
+        self._queue.put_nowait(path)
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    async def _run(self) -> None:
+        while True:
+            batch = await next_batch(self._queue, self.batch_size, self.batch_window)
+            # The same file queued twice in a window only needs to go once
+            paths = list(dict.fromkeys(batch))
+            try:
+                for attempt in range(self.max_retries):
+                    try:
+                        await self.transport.send(paths)
+                    except Exception as e:
+                        self.stats.failures += 1
+                        log.warning(f"Transfer of {len(paths)} files failed with exception {e}")
+                        await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                        continue
+                    self.stats.batches += 1
+                    self.stats.files += len(paths)
+                    log.debug(f"Sent {len(paths)} files")
+                    try:
+                        # A file replaced or removed since the send, or a failing
+                        # callback, must not kill the worker and hang stop()
+                        self.stats.bytes += sum(os.path.getsize(path) for path in paths)
+                        if self.on_sent is not None:
+                            self.on_sent(paths)
+                    except Exception as e:
+                        log.error(f"After sending {len(paths)} files failed with exception {e}")
+                    break
+                else:
+                    self.stats.dropped += len(paths)
+                    log.error(f"Dropped {paths} after {self.max_retries} attempts")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+async def test_transfer() -> None:
+    log.setLevel(logging.DEBUG)
+    with tempfile.TemporaryDirectory() as src_dir, tempfile.TemporaryDirectory() as dest_dir:
+        paths = []
+        for i in range(40):
+            path = os.path.join(src_dir, f"{i}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(1024 * (i + 1)))
+            paths.append(path)
+        # A half finished upload is resumed instead of restarted
+        with open(paths[0], "rb") as f, open(os.path.join(dest_dir, "0.bin" + PARTIAL_SUFFIX), "wb") as partial:
+            partial.write(f.read(512))
+        queue = await TransferQueue(LocalTransport(dest_dir)).start()
+        start_time = time.monotonic()
+        for path in paths:
+            queue.enqueue(path)
+        log.debug(f"Enqueued {len(paths)} files in {time.monotonic() - start_time:.6f} seconds")
+        await queue.stop()
+        for path in paths:
+            with open(path, "rb") as a, open(os.path.join(dest_dir, os.path.basename(path)), "rb") as b:
+                assert a.read() == b.read(), path
+        assert queue.stats.files == len(paths)
+        log.debug(f"Sent {queue.stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_transfer())